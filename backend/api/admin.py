@@ -9,7 +9,10 @@ admin.site.register(StaffImageFile)
 admin.site.register(ClientImageFile)
 admin.site.register(Drug)
 admin.site.register(Message)
+admin.site.register(ConversationSummary)
 admin.site.register(DietPlan)
 admin.site.register(DrugStock)
+admin.site.register(StockMovement)
+admin.site.register(Tombstone)
 admin.site.register(Order)
 admin.site.register(OrderItem)
\ No newline at end of file
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.core.management import call_command
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        import api.signals
+        post_migrate.connect(create_cache_tables, sender=self)
+
+
+# Tables of the DatabaseCache aliases, created if missing on every migrate
+def create_cache_tables(**kwargs):
+    call_command('createcachetable', database=kwargs.get('using', 'default'), verbosity=0)
@@ -0,0 +1,97 @@
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from api.serializer import DrugValuesSerializer
+from api.loaders import catalog_drugs
+from api.utils import get_cache_version, bump_cache_version
+from api.renderers import ORJSONRenderer, MessagePackRenderer, msgpack_packer
+from api.compression import compress, choose_encoding, gzip_splice
+
+CATALOG_VERSION_KEY = 'drug_catalog:version'
+CATALOG_KEY = 'drug_catalog:{version}:{format}:{encoding}'
+CATALOG_TIMEOUT = 60 * 60 * 24
+CATALOG_RENDERERS = {'json': ORJSONRenderer, 'msgpack': MessagePackRenderer}
+
+# Last snapshot this worker rendered or fetched in each format and
+# encoding, as (version, bytes)
+_local_snapshots = {}
+
+
+def catalog_version():
+    return get_cache_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_cache_version(CATALOG_VERSION_KEY)
+
+
+def build_catalog(format='json'):
+    return CATALOG_RENDERERS[format]().render(DrugValuesSerializer().serialize(catalog_drugs()))
+
+
+# The snapshot of a catalog version in one format and encoding ('identity'
+# or one of api.compression's). Each encoding is compressed once per version
+# from the identity bytes, the first time a request asks for it.
+def catalog_snapshot(version, format, encoding):
+    local_version, payload = _local_snapshots.get((format, encoding), (None, None))
+    if local_version == version:
+        return payload
+
+    key = CATALOG_KEY.format(version=version, format=format, encoding=encoding)
+    payload = cache.get(key)
+    if payload is None:
+        payload = build_catalog(format) if encoding == 'identity' else compress(catalog_snapshot(version, format, 'identity'), encoding)
+        cache.set(key, payload, timeout=CATALOG_TIMEOUT)
+    _local_snapshots[(format, encoding)] = (version, payload)
+    return payload
+
+
+def get_catalog(format='json', encoding='identity'):
+    return catalog_snapshot(catalog_version(), format, encoding)
+
+
+def response_format(request):
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer.format if renderer and renderer.format in CATALOG_RENDERERS else 'json'
+
+
+def encoded_response(body, content_type, encoding=None):
+    response = HttpResponse(body, content_type=content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+    return response
+
+
+# What goes before and after the catalog snapshot when it is added to data
+# under "drugs" without decoding it
+def catalog_envelope(data, format='json'):
+    if format == 'msgpack':
+        packer = msgpack_packer()
+        head = packer.pack_map_header(len(data) + 1) + b''.join(packer.pack(key) + packer.pack(value) for key, value in data.items())
+        return head + packer.pack('drugs'), b''
+    body = ORJSONRenderer().render(data)
+    separator = b',' if data else b''
+    return body[:-1] + separator + b'"drugs":', b'}'
+
+
+# Rendered in the format the request negotiated (JSON for the browsable
+# API). Gzip responses splice in the catalog compressed for this version,
+# so only the per-client part is compressed per request.
+def catalog_response(request, data):
+    format = response_format(request)
+    content_type = CATALOG_RENDERERS[format].media_type
+    prefix, suffix = catalog_envelope(data, format)
+    version = catalog_version()
+    body = catalog_snapshot(version, format, 'identity')
+    if choose_encoding(request, ['gzip']):
+        fragment = catalog_snapshot(version, format, 'deflate_fragment')
+        return encoded_response(gzip_splice(prefix, body, fragment, suffix), content_type, 'gzip')
+    return encoded_response(prefix + body + suffix, content_type)
+
+
+# The catalog on its own, served straight from the stored brotli or gzip bytes
+def catalog_only_response(request):
+    format = response_format(request)
+    encoding = choose_encoding(request)
+    return encoded_response(get_catalog(format, encoding or 'identity'), CATALOG_RENDERERS[format].media_type, encoding)
@@ -0,0 +1,233 @@
+import json
+import traceback
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from api.models import *
+from api.serializer import *
+from api.intents import classify_message, MESSAGE_CATEGORIES
+from api.utils import log_error, send_prompt_to_gemini, stream_prompt_to_gemini
+from api.gemini import submit_gemini_task
+from api.retrieval import medicine_context
+
+CASSANDRA_INTRO = """
+                You are Cassandra, an AI assistant for Aivise Health.
+
+                Aivise Health is a digital healthcare platform that offers a range of services, including:
+                - In-person consultations
+                - E-pharmacy (medicine ordering and delivery)
+                - Diet and nutrition advice
+                - Mental health support and psychological counseling
+                - Herbal and alternative medicine guidance
+
+                Facility working ours: 
+                Monday - Friday : 8:30am - 730pm
+
+                Facility Location:
+                35 Aviation Road, Airport Residential Area, Accra, Ghana
+
+                As Cassandra, you assist users by:
+                - Answering health-related questions
+                - Recommending appropriate services or products
+                - Clearly communicating that you are part of Aivise Health
+                """
+
+CASSANDRA_INSTRUCTIONS = """
+            Avoid repeating greetings, or reintroducing yourself (e.g., don't say "Hi, I'm Cassandra" if you've already said it in previous conversations).
+            Just continue the conversation naturally.
+            **Important**
+            Be concise and professional
+            Only mention the user's name if they ask for it, or once at the start of a conversation. Avoid repeating it in every message.
+            """
+
+MESSAGE_CATEGORIES_PROMPT = """
+            1. In-person consultation (consultation booking and scheduling)
+            2. E-pharmacy (medicine ordering and delivery)
+            3. Diet and nutrition advice
+            4. Mental health support and psychological counseling
+            5. Herbal and alternative medicine guidance
+            6. Other
+            """
+
+
+def intent_prompt(user_message):
+    return f"""
+            {CASSANDRA_INTRO}
+
+            User message: {user_message}
+
+            Available services:
+            {MESSAGE_CATEGORIES_PROMPT}
+
+            Based on the user message, which of the above services is it most related to?
+            Return the **service number only** (e.g., 2). Do not include any extra text.
+            """
+
+
+def classify_chat_message(user_message):
+    category_number = classify_message(user_message)
+    if category_number is not None:
+        return category_number, 'model'
+    message_intent = send_prompt_to_gemini(intent_prompt(user_message), cache_site='message_intent')
+    return int(str(message_intent).split('.')[0].strip()), 'gemini'
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text or '') // 4 + 1
+
+
+def format_turn(message):
+    return f"{message['sender']}: {message['message']}"
+
+
+# Most recent messages that fit the token budget, oldest first
+def history_window(client):
+    recent = Message.objects.filter(client=client).order_by('-id').values('id', 'sender', 'message')[:settings.CHAT_HISTORY_MAX_MESSAGES]
+    window, tokens = [], 0
+    for message in recent:
+        tokens += estimate_tokens(format_turn(message))
+        if tokens > settings.CHAT_HISTORY_TOKEN_BUDGET:
+            break
+        window.append(message)
+    window.reverse()
+    return window
+
+
+# The summary, then the turns that left the window but are not folded into
+# it yet (fewer than CHAT_SUMMARY_MIN_BATCH unless the summary job is behind),
+# then the window
+def build_history(client):
+    summary, last_message_id = ConversationSummary.objects.filter(client=client).values_list('summary', 'last_message_id').first() or (None, 0)
+    window = history_window(client)
+    pending = []
+    if window:
+        pending = list(
+            Message.objects.filter(client=client, id__gt=last_message_id, id__lt=window[0]['id'])
+            .order_by('-id').values('id', 'sender', 'message')[:settings.CHAT_SUMMARY_MIN_BATCH]
+        )
+        pending.reverse()
+    turns = '\n'.join(format_turn(message) for message in pending + window)
+    if summary:
+        return f"Summary of earlier conversations: {summary}\n\n{turns}"
+    return turns
+
+
+def summary_prompt(summary, turns):
+    return f"""
+            You maintain a running summary of a patient's conversations with Cassandra, the Aivise Health assistant.
+
+            Current summary:
+            {summary or 'None yet'}
+
+            Earlier messages to fold into the summary:
+            {turns}
+
+            Rewrite the summary so it includes the new messages. Keep health conditions, medicines, orders, bookings,
+            preferences and open questions; drop greetings and small talk. Use at most {settings.CHAT_SUMMARY_MAX_WORDS} words.
+            Return only the summary text.
+            """
+
+
+# Folds messages that have slid out of the history window into the client's
+# rolling summary. Only messages after last_message_id are sent, so each
+# turn is summarized once. They are folded oldest first, CHAT_SUMMARY_BATCH
+# at a time, and only once at least CHAT_SUMMARY_MIN_BATCH are waiting; until
+# then build_history sends them as they are. The summary is only written if
+# last_message_id is still what this job read, so when two jobs for a client
+# overlap, the one that finishes second stops instead of folding the same
+# turns twice or overwriting the other's summary.
+def update_conversation_summary(client_id):
+    client = Client.objects.get(id=client_id)
+    window = history_window(client)
+    if not window:
+        return
+    summary_obj, _ = ConversationSummary.objects.get_or_create(client=client)
+    max_length = settings.CHAT_SUMMARY_MAX_WORDS * 8
+    while True:
+        evicted = list(
+            Message.objects.filter(client=client, id__gt=summary_obj.last_message_id, id__lt=window[0]['id'])
+            .order_by('id').values('id', 'sender', 'message')[:settings.CHAT_SUMMARY_BATCH]
+        )
+        if not evicted or len(evicted) < settings.CHAT_SUMMARY_MIN_BATCH:
+            return
+        turns = '\n'.join(format_turn(message) for message in evicted)
+        summary = send_prompt_to_gemini(summary_prompt(summary_obj.summary, turns)).strip()
+        updated = ConversationSummary.objects.filter(id=summary_obj.id, last_message_id=summary_obj.last_message_id).update(
+            summary=summary[:max_length], last_message_id=evicted[-1]['id'],
+        )
+        if not updated or len(evicted) < settings.CHAT_SUMMARY_BATCH:
+            return
+        summary_obj.summary, summary_obj.last_message_id = summary[:max_length], evicted[-1]['id']
+
+
+def run_summary_update(client_id):
+    try:
+        update_conversation_summary(client_id)
+    except Exception:
+        log_error(traceback.format_exc())
+
+
+def schedule_summary_update(client_id):
+    submit_gemini_task(run_summary_update, client_id)
+
+
+# Builds the Cassandra reply prompt for a chat message; returns the prompt,
+# the service category of the message and where the category came from
+def build_chat_prompt(client, client_data, user_message):
+    category_number, category_source = classify_chat_message(user_message)
+    history = build_history(client)
+    prompt_histry = f"""
+            **History of passed conversations with the user**:
+            {history}
+            """
+    profile_history_message = f"User Profile: {client_data}\n\n{prompt_histry}\nuser: {user_message}\ncassandra: "
+    additional_data = f"Available Medicines In Stock (most relevant to the message): {medicine_context(user_message)}"
+    if category_number == 1:
+        staff_data = json.dumps(StaffSerializerOne(Staff.objects.select_related('user', 'img'), many=True).data, indent=2)
+        additional_data = f"Available staff for consultations: {staff_data}\n\n{additional_data}"
+    prompt = f"{CASSANDRA_INTRO}\n{CASSANDRA_INSTRUCTIONS}\n\n{additional_data}\n\n{profile_history_message}"
+    return prompt, category_number, category_source
+
+
+def save_chat_exchange(client, user_message, reply, category_number, category_source):
+    if category_number not in MESSAGE_CATEGORIES:
+        category_number = category_source = None
+    user_message_obj = Message.objects.create(client=client, sender='user', message=user_message, category=category_number, category_source=category_source)
+    gemini_message_obj = Message.objects.create(client=client, sender='cassandra', message=reply)
+    user_message_data = {'id': user_message_obj.id,'sender': user_message_obj.sender,'message': user_message_obj.message}
+    gemini_message_data = {'id': gemini_message_obj.id,'sender': gemini_message_obj.sender,'message': gemini_message_obj.message}
+    transaction.on_commit(lambda: schedule_summary_update(client.id))
+    return [user_message_data, gemini_message_data]
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Server-sent events for a chat reply: a "token" event per chunk as Gemini
+# generates it, then "done" with the saved message pair, or "error"
+async def stream_chat_reply(client, client_data, user_message):
+    try:
+        prompt, category_number, category_source = await sync_to_async(build_chat_prompt)(client, client_data, user_message)
+        chunks = stream_prompt_to_gemini(prompt)
+        reply = []
+        try:
+            while True:
+                text = await sync_to_async(next, thread_sensitive=False)(chunks, None)
+                if text is None:
+                    break
+                reply.append(text)
+                yield sse_event('token', {'text': text})
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # Still running in a worker thread after a disconnect; it is closed when collected
+                pass
+
+        messages = await sync_to_async(save_chat_exchange)(client, user_message, ''.join(reply), category_number, category_source)
+        yield sse_event('done', messages)
+    except Exception:
+        log_error(traceback.format_exc())
+        yield sse_event('error', {'message': 'Connection Error'})
@@ -6,13 +6,27 @@ from email.mime.image import MIMEImage
 # Django Restframework
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
-from django.db.models import Prefetch
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from api.models import *
-from django.db import transaction
+from django.conf import settings
 from api.serializer import *
-from api.utils import log_error, use_pusher, send_prompt_to_gemini
+from api.loaders import load_client_bundle, load_client_page, parse_selection, drug_detail_queryset, catalog_drugs, CLIENT_COLLECTIONS, InvalidSelection
+from api.pagination import InvalidCursor
+from api.sync import sync_token, read_sync_token, sync_token_expired, load_client_changes
+from api.catalog import catalog_response, catalog_only_response
+from api.search import search_drugs
+from api.matching import match_staff
+from api.chat import build_chat_prompt, save_chat_exchange, stream_chat_reply
+from api.diet import enqueue_diet_plan, fail_stale_diet_plans
+from api.orders import place_order, cancel_order, OrderUnavailable
+from api.utils import log_error, use_pusher, send_prompt_to_gemini, submit_prompt_to_gemini
+from api.gemini import gemini_cache_stats
 
 import json
 from datetime import timedelta
@@ -21,28 +35,34 @@ from datetime import datetime
 import traceback
 import imghdr
 
+DEFAULT_CONSULTATION_NAME = 'New Consultation'
+
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def client_data(request):
     user = request.user
     if request.method == 'GET':
+        try:
+            sections, fields = parse_selection(request.GET)
+        except InvalidSelection as e:
+            return Response({'message': str(e)}, status=400)
+
         client = Client.objects.get(user=request.user)
-        consultations = Consultation.objects.filter(client=client)
-        consultations_data = ConsultationSerializerOne(consultations, many=True).data
-        drugs_data = DrugSerializerOne(Drug.objects.all(), many=True).data
-        order_data = OrderSerializerOne(Order.objects.filter(client=client), many=True).data
-        message_data = MessageSerializerOne(Message.objects.filter(client=client).order_by('id'), many=True).data
-        diet_plans = DietPlanSerializerOne(DietPlan.objects.filter(client=client), many=True).data
+        token = sync_token(timezone.now())
+        if request.GET.get('since'):
+            try:
+                since = read_sync_token(request.GET['since'])
+            except InvalidCursor as e:
+                return Response({'message': str(e)}, status=400)
+            if not sync_token_expired(since):
+                return Response({**load_client_changes(client, since, sections, fields), 'sync_token': token})
 
-        
-        return Response({
-            'consultations': consultations_data,
-            'drugs': drugs_data,
-            'orders': order_data,
-            'messages': message_data,
-            'diet_plans': diet_plans
-        })
+        bundle = load_client_bundle(client, sections, fields)
+        bundle['sync_token'] = token
+        if 'drugs' in sections and 'drugs' not in fields:
+            return catalog_response(request, bundle)
+        return Response(bundle)
     
     elif request.method == 'POST':
         data = request.data
@@ -51,23 +71,33 @@ def client_data(request):
             date, time, purpose = data_obj.get('date'), data_obj.get('time'), data_obj.get('purpose')
             try:
                 client = Client.objects.get(user=request.user)
-                client_data = ClientSerializer(client).data
-                staff_data = StaffSerializer(Staff.objects.all(), many=True).data
                 prompt = f"Give me a name(maximum 50 characters) i can use based on the consultation booking purpose: {purpose}.\nI will show the name as the name of a consultation to the user so choose an appropriate one. Return only the name and nothing else."
-                name = send_prompt_to_gemini(prompt)
-                message = f"""
-                    Based on the following client information and the purpose of their consultation, please select the most suitable staff member from the list below who can best handle their request.
-                    Client Data:
-                    {client_data}
-                    Consultation Description:
-                    "{purpose}"
-                    Available Staff:
-                    {staff_data}
-                    Consider factors like area of specialization, experience, and any other relevant fields available in the staff data. Return only the best match and explain why they were chosen.
-                    Return only the id of the staff if a match is found else return 0. Don't add any other text.
-                    """
+                name_request = submit_prompt_to_gemini(prompt, cache_site='consultation_name')
+                local_match = match_staff(purpose)
+                match_request = None
+                if not local_match:
+                    client_data = ClientSerializer(client).data
+                    staff_data = StaffSerializer(Staff.objects.all(), many=True).data
+                    message = f"""
+                        Based on the following client information and the purpose of their consultation, please select the most suitable staff member from the list below who can best handle their request.
+                        Client Data:
+                        {client_data}
+                        Consultation Description:
+                        "{purpose}"
+                        Available Staff:
+                        {staff_data}
+                        Consider factors like area of specialization, experience, and any other relevant fields available in the staff data. Return only the best match and explain why they were chosen.
+                        Return only the id of the staff if a match is found else return 0. Don't add any other text.
+                        """
+                    match_request = submit_prompt_to_gemini(message)
                 try:
-                    match_staff_id = int(send_prompt_to_gemini(message))
+                    name = name_request.result().strip()
+                except Exception:
+                    log_error(traceback.format_exc())
+                    name = DEFAULT_CONSULTATION_NAME
+
+                try:
+                    match_staff_id = local_match.staff_id if local_match else int(match_request.result())
                     match_staff_obj = Staff.objects.select_related('user').filter(id=match_staff_id).first()
                     if not match_staff_obj:
                         raise Exception
@@ -96,79 +126,19 @@ def client_data(request):
             activity_level = data_obj.get('activity_level')
             preferred_foods = data_obj.get('preferred_foods').split(',') if data_obj.get('preferred_foods') and data_obj.get('preferred_foods') != 'null' else []
             end_date = (datetime.strptime(timezone.now().date().strftime('%Y-%m-%d'), '%Y-%m-%d') + timedelta(days=duration_days - 1)).strftime('%Y-%m-%d')
-            try:
-                client_data = json.dumps(ClientSerializer(client).data, indent=2)
-                prompt = f"""
-                Generate a detailed {duration_days}-day diet plan based on the following user profile:
-
-                User Profile:
-                {client_data}
-
-                Diet Plan Details:
-                - Goal: {goal}
-                - Diet type: {diet_type}
-                - Duration: {duration_days} days
-                - Meal types per day: {meal_types}
-                - Activity level: {activity_level}
-                - Preferred foods: {preferred_foods}
-
-                **Important**
-                Consider foods from the user's country or nationality
-
-                Return the diet plan as a JSON list with the following structure:
-
-                [
-                    {{
-                        "day": 1,
-                        "date": "2025-06-01",
-                        "meals": {{
-                            "breakfast": ["Oatmeal with berries", "Green tea"],
-                            "lunch": ["Grilled chicken salad", "Quinoa"],
-                            "dinner": ["Baked salmon", "Steamed vegetables"],
-                            "snacks": ["Almonds", "Apple"]
-                        }},
-                        "notes": "Drink at least 8 glasses of water."
-                    }},
-                    {{
-                        "day": 2,
-                        "date": "2025-06-02",
-                        "meals": {{
-                            "breakfast": ["Greek yogurt with honey", "Orange juice"],
-                            "lunch": ["Turkey sandwich", "Carrot sticks"],
-                            "dinner": ["Stir-fried tofu", "Brown rice"],
-                            "snacks": ["Mixed nuts", "Banana"]
-                        }},
-                        "notes": "Include light exercise."
-                    }}
-                ]
-
-                **Important**
-                Return only JSON, no code blocks, no explanations, no markdown, just raw JSON text
-                """
-                raw_response = send_prompt_to_gemini(prompt)
-                cleaned_response = re.sub(r"^```json|```$", "", raw_response.strip(), flags=re.IGNORECASE).strip()
-                cleaned_response = cleaned_response.strip("` \n")
-                try:
-                    diet_plan_json = json.loads(cleaned_response)
-                except json.JSONDecodeError as e:
-                    raise e
-                
-                diet_plan = DietPlan.objects.create(
-                    client=client,
-                    goal=goal,
-                    diet_type=diet_type,
-                    duration_days=duration_days,
-                    meal_types=meal_types,
-                    activity_level=activity_level,
-                    preferred_foods=[x.strip() for x in preferred_foods],
-                    end_date=end_date,
-                    plans=diet_plan_json,
-                )
-                return Response(DietPlanSerializerOne(diet_plan).data)
-                
-            except Exception:
-                log_error(traceback.format_exc())
-                return Response({'message': 'Connection Error'}, status=400)
+            diet_plan = DietPlan.objects.create(
+                client=client,
+                goal=goal,
+                diet_type=diet_type,
+                duration_days=duration_days,
+                meal_types=meal_types,
+                activity_level=activity_level,
+                preferred_foods=[x.strip() for x in preferred_foods],
+                end_date=end_date,
+                status='pending',
+            )
+            enqueue_diet_plan(diet_plan.id, use_template=not data_obj.get('fresh'))
+            return Response(DietPlanSerializerOne(diet_plan).data, status=202)
             
         elif data['type'] == 'deleteDietPlan':
             item_to_delete = DietPlan.objects.get(id=int(data['itemId']))
@@ -177,77 +147,11 @@ def client_data(request):
 
         elif data['type'] == 'sendMessage':
             client = Client.objects.get(user=request.user)
-            client_data, history, user_message = json.dumps(json.loads(data['clientData']), indent=2), data['history'], data['message']
-            intro = """
-                You are Cassandra, an AI assistant for Aivise Health.
-
-                Aivise Health is a digital healthcare platform that offers a range of services, including:
-                - In-person consultations
-                - E-pharmacy (medicine ordering and delivery)
-                - Diet and nutrition advice
-                - Mental health support and psychological counseling
-                - Herbal and alternative medicine guidance
-
-                Facility working ours: 
-                Monday - Friday : 8:30am - 730pm
-
-                Facility Location:
-                35 Aviation Road, Airport Residential Area, Accra, Ghana
-
-                As Cassandra, you assist users by:
-                - Answering health-related questions
-                - Recommending appropriate services or products
-                - Clearly communicating that you are part of Aivise Health
-                """
-
-            instructions = """
-            Avoid repeating greetings, or reintroducing yourself (e.g., don't say "Hi, I'm Cassandra" if you've already said it in previous conversations).
-            Just continue the conversation naturally.
-            **Important**
-            Be concise and professional
-            Only mention the user's name if they ask for it, or once at the start of a conversation. Avoid repeating it in every message.
-            """
-            prompt_histry = f"""
-            **History of passed conversations with the user**:
-            {history}
-            """
-
-            message_categories = """
-            1. In-person consultation (consultation booking and scheduling)
-            2. E-pharmacy (medicine ordering and delivery)
-            3. Diet and nutrition advice
-            4. Mental health support and psychological counseling
-            5. Herbal and alternative medicine guidance
-            6. Other
-            """
-            prompt_1 = f"""
-            {intro}
-
-            User message: {user_message}
-
-            Available services:
-            {message_categories}
-
-            Based on the user message, which of the above services is it most related to?
-            Return the **service number only** (e.g., 2). Do not include any extra text.
-            """
-            message_intent = send_prompt_to_gemini(prompt_1)
+            client_data, user_message = json.dumps(json.loads(data['clientData']), indent=2), data['message']
             try:
-                category_number = int(str(message_intent).split('.')[0].strip())
-                profile_history_message = f"User Profile: {client_data}\n\n{prompt_histry}\nuser: {user_message}\ncassandra: "
-                additional_data = ''
-                if category_number == 1:
-                    staff_data = json.dumps(StaffSerializerOne(Staff.objects.all(), many=True).data, indent=2)
-                    additional_data = f"Available staff for consultations: {staff_data}"
-                drugs_data = json.dumps(DrugStockSerializerOne(DrugStock.objects.all(), many=True).data, indent=2)
-                additional_data = f"Available Medicines In Stock: {drugs_data}"
-                prompt_2 = f"{intro}\n{instructions}\n\n{additional_data}\n\n{profile_history_message}"
-                gemini_message = send_prompt_to_gemini(prompt_2)
-                user_message_obj = Message.objects.create(client=client, sender='user', message=user_message)
-                gemini_message_obj = Message.objects.create(client=client, sender='cassandra', message=gemini_message)
-                user_message_data = {'id': user_message_obj.id,'sender': user_message_obj.sender,'message': user_message_obj.message}
-                gemini_message_data = {'id': gemini_message_obj.id,'sender': gemini_message_obj.sender,'message': gemini_message_obj.message}
-                return Response([user_message_data, gemini_message_data])
+                prompt, category_number, category_source = build_chat_prompt(client, client_data, user_message)
+                gemini_message = send_prompt_to_gemini(prompt)
+                return Response(save_chat_exchange(client, user_message, gemini_message, category_number, category_source))
 
             except Exception:
                 log_error(traceback.format_exc())
@@ -256,32 +160,134 @@ def client_data(request):
         elif data['type'] == 'placeOrder':
             order_items = json.loads(data['orderItems'])
             client = Client.objects.get(user=request.user)
-            with transaction.atomic():
-                try:
-                    order_obj = Order.objects.create(client=client, address=client.address, date=timezone.now().date())
-                    for _item_ in order_items:
-                        if not int(_item_['quantity'] == 0):
-                            drug_obj = DrugStock.objects.get(id=int(_item_['id']))
-                            order_item_obj = OrderItem.objects.create(order=order_obj, drug=drug_obj, quantity=_item_['order_quantity'])
-                            drug_obj.quantity -= int(order_item_obj.quantity)
-                            drug_obj.save(update_fields=['quantity'])
-                            order_item_obj.update_fields()
-
-                    order_obj.update_fields()
-                    order_data = OrderSerializerOne(order_obj).data
-                    return Response(order_data)
-                except Exception:
-                    transaction.set_rollback(True)
-                    log_error(traceback.format_exc())
-                    return Response({'message': "Connection Error"}, status=400)
+            try:
+                order_obj = place_order(client, order_items)
+                return Response(OrderSerializerOne(order_obj).data)
+            except OrderUnavailable as e:
+                return Response({'message': str(e)}, status=400)
+            except Exception:
+                log_error(traceback.format_exc())
+                return Response({'message': "Connection Error"}, status=400)
         
         elif data['type'] == 'deleteOrder':
-            order_item = Order.objects.prefetch_related(Prefetch('items', queryset=OrderItem.objects.select_related('drug'))).get(id=int(data['itemId']))
-            items = order_item.items.all()
-            items_instances = []
-            for item in items:
-                item.drug.quantity += item.quantity
-                items_instances.append(item)
-            OrderItem.objects.bulk_update(items_instances, ['quantity'])
-            order_item.delete()
+            client = Client.objects.get(user=request.user)
+            try:
+                if not cancel_order(client, int(data['itemId'])):
+                    return Response({'message': 'Order not found'}, status=404)
+            except OrderUnavailable as e:
+                return Response({'message': str(e)}, status=400)
             return Response(status=204)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def drug_detail(request, drug_id):
+    try:
+        drug = drug_detail_queryset().get(id=drug_id)
+    except Drug.DoesNotExist:
+        return Response({'message': 'Drug not found'}, status=404)
+
+    return Response(DrugSerializerTwo(drug).data)
+
+
+def get_page_params(request, default_page_size=20, max_page_size=100):
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', default_page_size)), 1), max_page_size)
+    except ValueError:
+        page, page_size = 1, default_page_size
+    return page, page_size
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def client_collection(request, collection):
+    if collection not in CLIENT_COLLECTIONS:
+        return Response({'message': 'Not found'}, status=404)
+
+    client = Client.objects.get(user=request.user)
+    _, page_size = get_page_params(request, default_page_size=settings.CLIENT_PAGE_SIZE)
+    try:
+        _, fields = parse_selection(request.GET)
+        results, next_cursor = load_client_page(client, collection, request.GET.get('cursor'), page_size, fields.get(collection))
+    except (InvalidCursor, InvalidSelection) as e:
+        return Response({'message': str(e)}, status=400)
+    return Response({'results': results, 'next_cursor': next_cursor})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def drug_catalog(request):
+    return catalog_only_response(request)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def drug_search(request):
+    page, page_size = get_page_params(request)
+    drug_ids, total = search_drugs(request.GET.get('q', ''), limit=page_size, offset=(page - 1) * page_size)
+    serializer = DrugValuesSerializer()
+    drugs = {row['id']: row for row in serializer.values(catalog_drugs().filter(id__in=drug_ids))}
+    return Response({
+        'count': total,
+        'page': page,
+        'page_size': page_size,
+        'results': serializer.render([drugs[x] for x in drug_ids if x in drugs]),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def drug_autocomplete(request):
+    drug_ids, _ = search_drugs(request.GET.get('q', ''), limit=10)
+    drugs = Drug.objects.only('id', 'name', 'generic_name', 'brand').in_bulk(drug_ids)
+    return Response([
+        {'id': x, 'name': drugs[x].name, 'generic_name': drugs[x].generic_name, 'brand': drugs[x].brand}
+        for x in drug_ids if x in drugs
+    ])
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def llm_cache_stats(request):
+    return Response(gemini_cache_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def diet_plan_status(request, diet_plan_id):
+    diet_plan = DietPlan.objects.filter(id=diet_plan_id, client__user=request.user).first()
+    if not diet_plan:
+        return Response({'message': 'Diet plan not found'}, status=404)
+
+    if diet_plan.status == 'pending' and fail_stale_diet_plans(DietPlan.objects.filter(id=diet_plan.id)):
+        diet_plan.status = 'failed'
+    if diet_plan.status == 'ready':
+        return Response({'id': diet_plan.id, 'status': diet_plan.status, 'diet_plan': DietPlanSerializerOne(diet_plan).data})
+    return Response({'id': diet_plan.id, 'status': diet_plan.status})
+
+
+# Streaming variant of the sendMessage branch of client_data. It is a plain
+# async view so that, under backend.asgi, tokens reach the browser as
+# server-sent events while Gemini is still generating.
+@csrf_exempt
+async def chat_stream(request):
+    if request.method != 'POST':
+        return JsonResponse({'message': 'Method not allowed'}, status=405)
+    try:
+        authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        authenticated = None
+    if not authenticated:
+        return JsonResponse({'message': 'You have been logged out'}, status=401)
+
+    client = await Client.objects.filter(user=authenticated[0]).afirst()
+    if not client:
+        return JsonResponse({'message': 'Invalid credentials'}, status=401)
+
+    data = request.POST
+    client_data, user_message = json.dumps(json.loads(data['clientData']), indent=2), data['message']
+    response = StreamingHttpResponse(stream_chat_reply(client, client_data, user_message), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,63 @@
+import re
+import gzip
+import zlib
+import struct
+import brotli
+from django.conf import settings
+
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+NOT_ACCEPTABLE = re.compile(r'\bq=0(\.0*)?\s*$')
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=settings.PRECOMPRESS_BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=settings.PRECOMPRESS_GZIP_LEVEL, mtime=0)
+    if encoding == 'deflate_fragment':
+        return deflate_fragment(body, settings.PRECOMPRESS_GZIP_LEVEL)
+    raise ValueError(f"Unknown encoding {encoding}")
+
+
+# Raw deflate blocks of body ending on a byte boundary and without a final
+# block, so they can be stitched between other blocks by gzip_splice
+def deflate_fragment(body, level=zlib.Z_DEFAULT_COMPRESSION):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+# A single gzip member holding prefix + body + suffix where body is already
+# compressed as fragment; only the small prefix and suffix are compressed
+# per request. Each part has its own compressor, so no back reference
+# crosses into a part it was not compressed with.
+def gzip_splice(prefix, body, fragment, suffix):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    head = compressor.compress(prefix) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    tail = compressor.compress(suffix) + compressor.flush()
+    crc = zlib.crc32(suffix, zlib.crc32(body, zlib.crc32(prefix)))
+    size = (len(prefix) + len(body) + len(suffix)) & 0xffffffff
+    return GZIP_HEADER + head + fragment + tail + struct.pack('<II', crc, size)
+
+
+# Encodings the request accepts and the ones it refuses with q=0
+def accepted_encodings(request):
+    accepted, refused = set(), set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if name:
+            (refused if NOT_ACCEPTABLE.search(params) else accepted).add(name)
+    return accepted, refused
+
+
+# The first of encodings (in order of preference) the request accepts. An
+# explicit q=0 refuses an encoding even when '*' accepts everything else.
+def choose_encoding(request, encodings=('br', 'gzip')):
+    accepted, refused = accepted_encodings(request)
+    for encoding in encodings:
+        if encoding in refused:
+            continue
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
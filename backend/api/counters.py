@@ -0,0 +1,17 @@
+from django.db.models import F
+from api.models import Counter
+
+
+# Counters kept in the database, so every worker reads the same value and
+# increments are atomic (a single UPDATE ... SET value = value + 1)
+def get_counter(name, initial=0):
+    value = Counter.objects.filter(name=name).values_list('value', flat=True).first()
+    if value is None:
+        value = Counter.objects.get_or_create(name=name, defaults={'value': initial})[0].value
+    return value
+
+
+def increment_counter(name, initial=0):
+    if not Counter.objects.filter(name=name).update(value=F('value') + 1):
+        Counter.objects.get_or_create(name=name, defaults={'value': initial})
+        Counter.objects.filter(name=name).update(value=F('value') + 1)
@@ -0,0 +1,314 @@
+import re
+import json
+import time
+import random
+import hashlib
+import traceback
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.core.cache import caches
+from django.utils import timezone
+from api.models import *
+from api.serializer import *
+from api.utils import log_error, use_pusher, send_prompt_to_gemini
+from api.gemini import count_cache_lookup, submit_gemini_task, GeminiUnavailable
+from api.text import tokenize
+
+_executor = None
+_executor_lock = threading.Lock()
+# (size, semaphore) of the Gemini slots diet plan chunks may hold at once
+_chunk_slots = (None, None)
+
+
+def diet_plan_prompt(client_data, diet_plan, first_day=1, days=None):
+    days = days or diet_plan.duration_days
+    last_day = first_day + days - 1
+    return f"""
+                Generate days {first_day} to {last_day} of a detailed {diet_plan.duration_days}-day diet plan based on the following user profile:
+
+                User Profile:
+                {client_data}
+
+                Diet Plan Details:
+                - Goal: {diet_plan.goal}
+                - Diet type: {diet_plan.diet_type}
+                - Duration: {diet_plan.duration_days} days
+                - Meal types per day: {diet_plan.meal_types}
+                - Activity level: {diet_plan.activity_level}
+                - Preferred foods: {diet_plan.preferred_foods}
+
+                **Important**
+                Consider foods from the user's country or nationality
+
+                Return exactly {days} days, numbered {first_day} to {last_day}, as a JSON list with the following structure:
+
+                [
+                    {{
+                        "day": {first_day},
+                        "date": "2025-06-01",
+                        "meals": {{
+                            "breakfast": ["Oatmeal with berries", "Green tea"],
+                            "lunch": ["Grilled chicken salad", "Quinoa"],
+                            "dinner": ["Baked salmon", "Steamed vegetables"],
+                            "snacks": ["Almonds", "Apple"]
+                        }},
+                        "notes": "Drink at least 8 glasses of water."
+                    }},
+                    {{
+                        "day": {first_day + 1},
+                        "date": "2025-06-02",
+                        "meals": {{
+                            "breakfast": ["Greek yogurt with honey", "Orange juice"],
+                            "lunch": ["Turkey sandwich", "Carrot sticks"],
+                            "dinner": ["Stir-fried tofu", "Brown rice"],
+                            "snacks": ["Mixed nuts", "Banana"]
+                        }},
+                        "notes": "Include light exercise."
+                    }}
+                ]
+
+                **Important**
+                Return only JSON, no code blocks, no explanations, no markdown, just raw JSON text
+                """
+
+
+def parse_plan(raw_response):
+    cleaned_response = re.sub(r"^```json|```$", "", raw_response.strip(), flags=re.IGNORECASE).strip()
+    cleaned_response = cleaned_response.strip("` \n")
+    return json.loads(cleaned_response)
+
+
+# Raises ValueError unless the chunk is exactly the requested days in order,
+# each with meals given as lists of dishes
+def validate_chunk(chunk, first_day, days):
+    if not isinstance(chunk, list) or len(chunk) != days:
+        raise ValueError(f"Expected a list of {days} days")
+    for expected_day, day in enumerate(chunk, start=first_day):
+        if not isinstance(day, dict) or day.get('day') != expected_day:
+            raise ValueError(f"Expected day {expected_day}")
+        meals = day.get('meals')
+        if not isinstance(meals, dict) or not meals:
+            raise ValueError(f"Day {expected_day} has no meals")
+        for dishes in meals.values():
+            if not isinstance(dishes, list) or not all(isinstance(dish, str) for dish in dishes):
+                raise ValueError(f"Day {expected_day} has malformed meals")
+        if not isinstance(day.get('notes', ''), str):
+            raise ValueError(f"Day {expected_day} has malformed notes")
+    return chunk
+
+
+# A malformed chunk is asked for again at once; one that found every Gemini
+# slot busy after a backoff, so the calls holding the slots can finish
+def generate_chunk(prompt, first_day, days):
+    for attempt in range(settings.DIET_PLAN_CHUNK_RETRIES + 1):
+        try:
+            return validate_chunk(parse_plan(send_prompt_to_gemini(prompt)), first_day, days)
+        except ValueError:
+            if attempt == settings.DIET_PLAN_CHUNK_RETRIES:
+                raise
+        except GeminiUnavailable:
+            if attempt == settings.DIET_PLAN_CHUNK_RETRIES:
+                raise
+            time.sleep(random.uniform(settings.GEMINI_BACKOFF, min(settings.GEMINI_MAX_BACKOFF, settings.GEMINI_BACKOFF * 2 ** (attempt + 1))))
+
+
+# Shared by the chunks of every plan being generated, whichever diet plan
+# worker runs it
+def get_chunk_slots():
+    global _chunk_slots
+    size = max(1, settings.GEMINI_MAX_CONCURRENCY - 1)
+    if _chunk_slots[0] != size:
+        with _executor_lock:
+            if _chunk_slots[0] != size:
+                _chunk_slots = (size, threading.BoundedSemaphore(size))
+    return _chunk_slots[1]
+
+
+# The plan is requested in DIET_PLAN_CHUNK_DAYS sized chunks that run side by
+# side on the Gemini pool. At most GEMINI_MAX_CONCURRENCY - 1 chunks are in
+# flight across all plans, so long plans neither wait on their own chunks for
+# a slot nor take every slot from chat and booking calls.
+def generate_chunked_plans(client_data, diet_plan):
+    chunk_days = settings.DIET_PLAN_CHUNK_DAYS
+    slots = get_chunk_slots()
+    chunks = []
+    for first_day in range(1, diet_plan.duration_days + 1, chunk_days):
+        days = min(chunk_days, diet_plan.duration_days - first_day + 1)
+        prompt = diet_plan_prompt(client_data, diet_plan, first_day, days)
+        slots.acquire()
+        if any(chunk.done() and chunk.exception() for chunk in chunks):
+            slots.release()
+            break
+        chunk = submit_gemini_task(generate_chunk, prompt, first_day, days)
+        chunk.add_done_callback(lambda _: slots.release())
+        chunks.append(chunk)
+    try:
+        return [day for chunk in chunks for day in chunk.result()]
+    finally:
+        for chunk in chunks:
+            chunk.cancel()
+
+
+def notes_prompt(client_data, plans):
+    meals = [day.get('meals', {}) for day in plans]
+    return f"""
+                Write a short note for each day of the following diet plan that speaks to this user personally,
+                such as a tip about the day's meals.
+
+                User Profile:
+                {client_data}
+
+                Meals of each day:
+                {json.dumps(meals)}
+
+                Return a JSON list of strings with exactly {len(meals)} items in the same order.
+                Return only JSON, no code blocks, no explanations, no markdown, just raw JSON text
+                """
+
+
+def normalized_list(values):
+    return sorted(set(str(x).strip().lower() for x in values or [] if str(x).strip()))
+
+
+# Everything in the profile that changes what Gemini would plan. Free-text
+# goals and foods are compared by their stemmed words, so "Lose weight" and
+# "lose weight!" share a template; health conditions and allergies are part
+# of the signature so a plan is never reused for a client it may not suit.
+def template_signature(diet_plan):
+    client = diet_plan.client
+    profile = {
+        'diet_type': diet_plan.diet_type,
+        'duration_days': diet_plan.duration_days,
+        'activity_level': diet_plan.activity_level,
+        'meal_types': normalized_list(diet_plan.meal_types),
+        'goal': sorted(set(tokenize(diet_plan.goal))),
+        'preferred_foods': sorted(set(tokenize(' '.join(diet_plan.preferred_foods or [])))),
+        'nationality': client.nationality,
+        'gender': client.gender,
+        'age_band': client.age // 10 if client.age else None,
+        'health_conditions': normalized_list(client.health_conditions),
+        'allergies': normalized_list(client.allergies),
+    }
+    return hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+
+
+def template_key(diet_plan):
+    return f"diet_template:{template_signature(diet_plan)}"
+
+
+def start_date(diet_plan):
+    if diet_plan.end_date:
+        return diet_plan.end_date - timedelta(days=diet_plan.duration_days - 1)
+    return timezone.now().date()
+
+
+# Point each day's date at the plan's own start, whatever dates the plan was
+# first generated with
+def rebase_dates(plans, start):
+    rebased = []
+    for index, day in enumerate(plans):
+        day = dict(day)
+        try:
+            offset = int(day.get('day', index + 1)) - 1
+        except (TypeError, ValueError):
+            offset = index
+        day['date'] = (start + timedelta(days=offset)).strftime('%Y-%m-%d')
+        rebased.append(day)
+    return rebased
+
+
+# Templates are shared by every client with an equivalent profile, but the
+# notes Gemini writes can mention the client the plan was first made for, so
+# they are blanked before the plan is stored
+def template_plans(plans):
+    return [dict(day, notes='') for day in plans]
+
+
+def personalize_notes(plans, client_data):
+    try:
+        rewritten = parse_plan(send_prompt_to_gemini(notes_prompt(client_data, plans)))
+        if not isinstance(rewritten, list) or len(rewritten) != len(plans):
+            return plans
+    except Exception:
+        log_error(traceback.format_exc())
+        return plans
+    return [dict(day, notes=str(note)) for day, note in zip(plans, rewritten)]
+
+
+# Plans come from the template store when an equivalent profile was planned
+# before; use_template=False always asks Gemini (the fresh plan still
+# replaces the stored template)
+def generate_plans(diet_plan, use_template=True):
+    client_data = json.dumps(ClientSerializer(diet_plan.client).data, indent=2)
+    llm_cache = caches['llm']
+    key = template_key(diet_plan)
+    template = llm_cache.get(key) if use_template else None
+    if template is not None:
+        count_cache_lookup('diet_plan_template', 'hits')
+        plans = rebase_dates(template, start_date(diet_plan))
+        if settings.DIET_PLAN_PERSONALIZE_NOTES:
+            plans = personalize_notes(plans, client_data)
+        return plans
+
+    if use_template:
+        count_cache_lookup('diet_plan_template', 'misses')
+    plans = generate_chunked_plans(client_data, diet_plan)
+    if plans:
+        llm_cache.set(key, template_plans(plans), timeout=settings.GEMINI_CACHE_TIMEOUTS['diet_plan_template'])
+    return rebase_dates(plans, start_date(diet_plan))
+
+
+# Pusher channels are public, so the event only says which plan finished;
+# the client fetches it through the authenticated status endpoint
+def notify_diet_plan(diet_plan):
+    try:
+        use_pusher().trigger(f"client_{diet_plan.client_id}", 'diet_plan', {'id': diet_plan.id, 'status': diet_plan.status})
+    except Exception:
+        log_error(traceback.format_exc())
+
+
+def run_diet_plan_job(diet_plan_id, use_template=True):
+    try:
+        diet_plan = DietPlan.objects.select_related('client__user', 'client__img').filter(id=diet_plan_id, status='pending').first()
+        if not diet_plan:
+            return
+        try:
+            diet_plan.plans = generate_plans(diet_plan, use_template)
+            diet_plan.status = 'ready'
+        except Exception:
+            log_error(traceback.format_exc())
+            diet_plan.status = 'failed'
+        # A plan deleted while it was being generated stays deleted
+        if DietPlan.objects.filter(id=diet_plan.id).update(plans=diet_plan.plans, status=diet_plan.status, updated_at=timezone.now()):
+            notify_diet_plan(diet_plan)
+    finally:
+        close_old_connections()
+
+
+def get_diet_plan_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.DIET_PLAN_WORKERS, thread_name_prefix='diet_plan')
+    return _executor
+
+
+# Generation starts once the pending row is committed, so the worker can see it
+def enqueue_diet_plan(diet_plan_id, use_template=True):
+    transaction.on_commit(lambda: get_diet_plan_executor().submit(run_diet_plan_job, diet_plan_id, use_template))
+
+
+# Jobs only live in the worker that queued them, so a plan still pending
+# DIET_PLAN_STALE_AFTER seconds after it was queued lost its job to a restart
+# or deploy
+def stale_diet_plans():
+    return DietPlan.objects.filter(status='pending', updated_at__lt=timezone.now() - timedelta(seconds=settings.DIET_PLAN_STALE_AFTER))
+
+
+def fail_stale_diet_plans(diet_plans=None):
+    diet_plans = stale_diet_plans() if diet_plans is None else diet_plans.filter(id__in=stale_diet_plans())
+    return diet_plans.update(status='failed', updated_at=timezone.now())
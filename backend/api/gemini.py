@@ -0,0 +1,212 @@
+import os
+import re
+import random
+import hashlib
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from api.counters import increment_counter
+from api.models import Counter
+
+RETRYABLE_ERRORS = (
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class GeminiUnavailable(Exception):
+    pass
+
+
+# Process-wide gateway to Gemini. The SDK is configured once per worker and
+# models are cached per name, so every prompt reuses the same client and
+# channel. Concurrent calls are capped so a slow upstream cannot hold every
+# worker thread.
+class GeminiGateway:
+    def __init__(self, api_key, model_name, timeout, max_retries, backoff, max_backoff, max_concurrency, acquire_timeout):
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name=None):
+        model_name = model_name or self.model_name
+        model = self._models.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._models.setdefault(model_name, genai.GenerativeModel(model_name))
+        return model
+
+    def backoff_delay(self, attempt):
+        # Full jitter keeps retries from concurrent callers apart
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise GeminiUnavailable('Too many Gemini requests in flight')
+
+    def with_retries(self, request, model_name=None):
+        model = self.model(model_name)
+        attempt = 0
+        while True:
+            try:
+                return request(model, {'timeout': self.timeout, 'retry': None})
+            except RETRYABLE_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+
+    def call(self, request, model_name=None):
+        self.acquire()
+        try:
+            return self.with_retries(request, model_name)
+        finally:
+            self._slots.release()
+
+    def generate(self, prompt, model_name=None):
+        return self.call(lambda model, options: model.generate_content(prompt, request_options=options).text, model_name)
+
+    # Yields the reply text as Gemini generates it. Only opening the stream is
+    # retried; the slot is held until the stream is exhausted or closed.
+    def stream(self, prompt, model_name=None):
+        self.acquire()
+        try:
+            chunks = self.with_retries(lambda model, options: start_stream(model.generate_content(prompt, stream=True, request_options=options)), model_name)
+            for chunk in chunks:
+                text = chunk_text(chunk)
+                if text:
+                    yield text
+        finally:
+            self._slots.release()
+
+
+def start_stream(response):
+    # Reading the first chunk surfaces connection errors while they can still be retried
+    chunks = iter(response)
+    first = next(chunks, None)
+    return chunks if first is None else itertools.chain([first], chunks)
+
+
+def chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # Chunks without text parts, e.g. a trailing safety or finish chunk
+        return ''
+
+
+_gateway = None
+_executor = None
+_gateway_lock = threading.Lock()
+
+
+def get_gemini():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = GeminiGateway(
+                    api_key=os.environ.get('GEMINI_KEY'),
+                    model_name=settings.GEMINI_MODEL,
+                    timeout=settings.GEMINI_TIMEOUT,
+                    max_retries=settings.GEMINI_MAX_RETRIES,
+                    backoff=settings.GEMINI_BACKOFF,
+                    max_backoff=settings.GEMINI_MAX_BACKOFF,
+                    max_concurrency=settings.GEMINI_MAX_CONCURRENCY,
+                    acquire_timeout=settings.GEMINI_ACQUIRE_TIMEOUT,
+                )
+    return _gateway
+
+
+def get_gemini_executor():
+    global _executor
+    if _executor is None:
+        with _gateway_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.GEMINI_MAX_CONCURRENCY * 2, thread_name_prefix='gemini')
+    return _executor
+
+
+def run_gemini_task(fn, *args):
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+# Runs fn on the shared Gemini pool and returns a Future. Pool threads live
+# outside the request cycle, so each task closes stale database connections
+# before and after it runs, like the diet plan workers do.
+def submit_gemini_task(fn, *args):
+    return get_gemini_executor().submit(run_gemini_task, fn, *args)
+
+
+# Response cache for prompts whose answer only depends on the prompt text.
+# Entries live in the "llm" cache alias, a LocMemCache in each worker that
+# evicts the least recently used entry past MAX_ENTRIES, with a TTL per call
+# site taken from GEMINI_CACHE_TIMEOUTS.
+def prompt_cache_key(prompt, model_name):
+    normalized = re.sub(r"\s+", " ", prompt).strip()
+    digest = hashlib.sha256(f"{model_name}\n{normalized}".encode()).hexdigest()
+    return f"gemini:{digest}"
+
+
+# Hit/miss counters are database rows (api.counters), so they add up every
+# worker's lookups, are incremented atomically and are never evicted with
+# the cached responses
+def count_cache_lookup(site, outcome):
+    increment_counter(f"gemini_stats:{site}:{outcome}")
+
+
+# The cache key of the prompt and its cached response, or None on a miss
+def lookup_cached_response(prompt, site, model_name=None):
+    key = prompt_cache_key(prompt, model_name or get_gemini().model_name)
+    response = caches['llm'].get(key)
+    count_cache_lookup(site, 'misses' if response is None else 'hits')
+    return key, response
+
+
+def generate_and_cache(key, prompt, site, model_name=None):
+    response = get_gemini().generate(prompt, model_name)
+    caches['llm'].set(key, response, timeout=settings.GEMINI_CACHE_TIMEOUTS[site])
+    return response
+
+
+def cached_generate(prompt, site, model_name=None):
+    key, response = lookup_cached_response(prompt, site, model_name)
+    if response is None:
+        response = generate_and_cache(key, prompt, site, model_name)
+    return response
+
+
+def gemini_cache_stats():
+    counters = dict(Counter.objects.filter(name__startswith='gemini_stats:').values_list('name', 'value'))
+    stats = {}
+    for site in settings.GEMINI_CACHE_TIMEOUTS:
+        hits = counters.get(f"gemini_stats:{site}:hits", 0)
+        misses = counters.get(f"gemini_stats:{site}:misses", 0)
+        stats[site] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0,
+        }
+    return stats
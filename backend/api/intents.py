@@ -0,0 +1,127 @@
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+from django.conf import settings
+from api.models import Drug, Message
+from api.text import tokenize
+
+# Service categories used to route chat messages, numbered as in the
+# Cassandra intent prompt
+MESSAGE_CATEGORIES = {
+    1: 'In-person consultation (consultation booking and scheduling)',
+    2: 'E-pharmacy (medicine ordering and delivery)',
+    3: 'Diet and nutrition advice',
+    4: 'Mental health support and psychological counseling',
+    5: 'Herbal and alternative medicine guidance',
+    6: 'Other',
+}
+
+SEED_PHRASES = {
+    1: [
+        'book a consultation', 'schedule an appointment with a doctor', 'see a doctor', 'reschedule my appointment',
+        'cancel my consultation', 'available doctors', 'book a specialist', 'appointment tomorrow', 'visit the clinic',
+        'checkup with a physician', 'consult a cardiologist', 'doctor appointment', 'follow up visit',
+    ],
+    2: [
+        'order medicine', 'buy drugs', 'do you have paracetamol in stock', 'medicine delivery', 'refill my prescription',
+        'price of amoxicillin', 'pharmacy', 'tablets', 'capsules', 'my order', 'track my order', 'dosage of ibuprofen',
+        'side effects of this drug', 'can i take this medication', 'painkillers', 'syrup for cough',
+        'deliver my medicine', 'is this drug available', 'buy tablets', 'order paracetamol', 'ibuprofen tablets',
+        'amoxicillin capsules', 'antibiotics', 'cough syrup', 'insulin', 'inhaler', 'cream for', 'how much does it cost',
+    ],
+    3: [
+        'diet plan', 'what should i eat', 'lose weight', 'gain weight', 'healthy meals', 'nutrition advice',
+        'calories', 'protein intake', 'vegetarian diet', 'keto', 'food for diabetes', 'breakfast ideas',
+        'meal plan', 'vitamins in food', 'eating healthy',
+    ],
+    4: [
+        'i feel depressed', 'anxiety', 'stress', 'i cannot sleep', 'insomnia', 'panic attacks', 'feeling sad',
+        'mental health', 'talk to a therapist', 'counseling', 'lonely', 'mood swings', 'grief', 'burnout',
+        'overthinking', 'psychologist', 'feeling stressed', 'sleep problems', 'worried all the time',
+        'feeling hopeless', 'nervous', 'emotional support',
+    ],
+    5: [
+        'herbal medicine', 'herbs for', 'natural remedy', 'alternative medicine', 'traditional medicine',
+        'ginger tea', 'moringa', 'garlic remedy', 'homeopathy', 'acupuncture', 'plant based remedy', 'neem leaves',
+        'herbal tea for', 'essential oils',
+    ],
+    6: [
+        'hello', 'hi', 'good morning', 'thank you', 'thanks', 'who are you', 'what are your working hours',
+        'where are you located', 'how are you', 'bye', 'what services do you offer', 'opening hours', 'location',
+    ],
+}
+HISTORY_EXAMPLES = 5000
+
+_lock = threading.Lock()
+# (built at, classifier)
+_model = (0, None)
+
+
+# Multinomial naive Bayes over the tokens of labelled messages
+class IntentClassifier:
+    def __init__(self, examples):
+        self.class_counts = Counter()
+        self.token_counts = defaultdict(Counter)
+        for text, category in examples:
+            tokens = tokenize(text)
+            if not tokens:
+                continue
+            self.class_counts[category] += 1
+            self.token_counts[category].update(tokens)
+        self.vocabulary = set(token for counts in self.token_counts.values() for token in counts)
+        total = sum(self.class_counts.values())
+        self.log_priors = {category: math.log(count / total) for category, count in self.class_counts.items()}
+        self.log_denominators = {
+            category: math.log(sum(counts.values()) + len(self.vocabulary))
+            for category, counts in self.token_counts.items()
+        }
+
+    def predict(self, text):
+        tokens = [token for token in tokenize(text) if token in self.vocabulary]
+        if not tokens:
+            return None, 0
+        scores = {}
+        for category, log_prior in self.log_priors.items():
+            counts = self.token_counts[category]
+            scores[category] = log_prior + sum(math.log(counts[token] + 1) - self.log_denominators[category] for token in tokens)
+        best = max(scores, key=scores.get)
+        # Posterior of the best class, computed stably from the log scores
+        probability = 1 / sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, probability
+
+
+def training_examples():
+    examples = [(phrase, category) for category, phrases in SEED_PHRASES.items() for phrase in phrases]
+    # Drug names in the catalog are strong e-pharmacy signals; they count as a
+    # single example so a large catalog does not skew the class prior
+    drug_names = ' '.join(f"{name} {generic_name or ''}" for name, generic_name in Drug.objects.values_list('name', 'generic_name'))
+    examples.append((drug_names, 2))
+    # Only Gemini's labels are learnt from; the model's own would reinforce its mistakes
+    history = (
+        Message.objects.filter(sender='user', category__isnull=False, category_source='gemini')
+        .order_by('-id')
+        .values_list('message', 'category')[:HISTORY_EXAMPLES]
+    )
+    return examples + list(history)
+
+
+def get_classifier():
+    global _model
+    built_at, classifier = _model
+    if classifier is None or time.monotonic() - built_at > settings.INTENT_MODEL_REFRESH:
+        with _lock:
+            built_at, classifier = _model
+            if classifier is None or time.monotonic() - built_at > settings.INTENT_MODEL_REFRESH:
+                classifier = IntentClassifier(training_examples())
+                _model = (time.monotonic(), classifier)
+    return classifier
+
+
+# Category number for a chat message, or None when the local model is not
+# confident and the caller should ask Gemini instead
+def classify_message(text):
+    category, probability = get_classifier().predict(text)
+    if category and probability >= settings.INTENT_CONFIDENCE_THRESHOLD:
+        return category
+    return None
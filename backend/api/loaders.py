@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.db.models import Prefetch
+from api.models import *
+from api.serializer import *
+from api.pagination import keyset_query, keyset_page, ID_KEYSET, DATE_KEYSET
+
+
+# Querysets for the client dashboard bundle. Each one is shaped after the
+# serializer that renders it so that serialization never goes back to the
+# database, whatever the number of rows.
+def client_consultations(client):
+    return Consultation.objects.filter(client=client).select_related('staff__user', 'staff__img', 'follow_up')
+
+
+def catalog_drugs():
+    stocks = DrugStock.objects.only(*DRUG_STOCK_LIST_FIELDS).order_by('id')
+    return Drug.objects.only(*DRUG_LIST_FIELDS).prefetch_related(Prefetch('stocks', queryset=stocks))
+
+
+def drug_detail_queryset():
+    return Drug.objects.prefetch_related(Prefetch('stocks', queryset=DrugStock.objects.order_by('id')))
+
+
+def client_orders(client):
+    return Order.objects.filter(client=client).prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('drug'))
+    )
+
+
+def client_messages(client):
+    return Message.objects.filter(client=client).order_by('id')
+
+
+def client_diet_plans(client):
+    return DietPlan.objects.filter(client=client)
+
+
+CLIENT_SECTIONS = ['consultations', 'orders', 'messages', 'diet_plans', 'drugs']
+
+# Bundle sections are read with .values() and rendered by the fast
+# serializers, which match the SerializerOne output byte for byte
+SECTION_SERIALIZERS = {
+    'consultations': ConsultationValuesSerializer,
+    'orders': OrderValuesSerializer,
+    'messages': MessageValuesSerializer,
+    'diet_plans': DietPlanValuesSerializer,
+    'drugs': DrugValuesSerializer,
+}
+
+# Collections served a page at a time: queryset and keyset order
+CLIENT_COLLECTIONS = {
+    'consultations': (client_consultations, DATE_KEYSET),
+    'orders': (client_orders, ID_KEYSET),
+    'messages': (client_messages, ID_KEYSET),
+}
+
+
+class InvalidSelection(ValueError):
+    pass
+
+
+# Sections asked for with ?include=a,b (all by default) and sparse fields
+# asked for with ?fields[section]=x,y. Only the columns and relations of the
+# requested fields are read.
+def parse_selection(params):
+    include = params.get('include')
+    sections = [x.strip() for x in include.split(',') if x.strip()] if include else list(CLIENT_SECTIONS)
+    for section in sections:
+        if section not in CLIENT_SECTIONS:
+            raise InvalidSelection(f"Unknown section {section}")
+
+    fields = {}
+    for section in CLIENT_SECTIONS:
+        value = params.get(f"fields[{section}]")
+        if value is None:
+            continue
+        names = [x.strip() for x in value.split(',') if x.strip()]
+        allowed = SECTION_SERIALIZERS[section]().names
+        for name in names:
+            if name not in allowed:
+                raise InvalidSelection(f"Unknown field {name} for {section}")
+        fields[section] = names
+    return sections, fields
+
+
+# Newest page of a collection, or the page after cursor, with the cursor of
+# the next (older) page. Messages are paged newest first but each page is
+# returned oldest first, the order the chat shows them in.
+def load_client_page(client, collection, cursor=None, page_size=None, fields=None):
+    queryset, keyset = CLIENT_COLLECTIONS[collection]
+    serializer = SECTION_SERIALIZERS[collection](fields)
+    rows, next_cursor = keyset_page(serializer.values(queryset(client), keyset.columns), keyset, collection, cursor, page_size or settings.CLIENT_PAGE_SIZE)
+    if collection == 'messages':
+        rows.reverse()
+    return serializer.render(rows), next_cursor
+
+
+# The query load_client_page runs for a page, for benchmarks and EXPLAIN
+def client_page_query(client, collection, cursor=None, page_size=None, fields=None):
+    queryset, keyset = CLIENT_COLLECTIONS[collection]
+    serializer = SECTION_SERIALIZERS[collection](fields)
+    return keyset_query(serializer.values(queryset(client), keyset.columns), keyset, collection, cursor, page_size or settings.CLIENT_PAGE_SIZE)
+
+
+# Sections that were not requested are never queried. The full drug catalog
+# is shared by every client and is spliced in from api.catalog by the caller;
+# drugs only appear here when specific fields of them were asked for.
+def load_client_bundle(client, sections=None, fields=None):
+    sections, fields = sections or CLIENT_SECTIONS, fields or {}
+    bundle = {'cursors': {}}
+    for collection in CLIENT_COLLECTIONS:
+        if collection in sections:
+            bundle[collection], bundle['cursors'][collection] = load_client_page(client, collection, fields=fields.get(collection))
+    if 'diet_plans' in sections:
+        bundle['diet_plans'] = DietPlanValuesSerializer(fields.get('diet_plans')).serialize(client_diet_plans(client))
+    if 'drugs' in sections and 'drugs' in fields:
+        bundle['drugs'] = DrugValuesSerializer(fields['drugs']).serialize(catalog_drugs())
+    return bundle
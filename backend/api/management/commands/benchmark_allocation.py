@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from api.models import Drug, DrugStock
+from api.orders import allocate_order
+
+
+class Command(BaseCommand):
+    help = "Time FEFO stock allocation against generated batches. All rows are rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drugs', type=int, default=5)
+        parser.add_argument('--batches', type=int, default=2000, help="Batches per drug")
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        with transaction.atomic():
+            drugs = [Drug.objects.create(name=f"Benchmark drug {index}") for index in range(options['drugs'])]
+            DrugStock.objects.bulk_create([
+                DrugStock(
+                    drug=drug,
+                    batch_number=f"BM{index}",
+                    name=drug.name,
+                    quantity=index % 7,
+                    price=Decimal('1.00'),
+                    expiry_date=today + timedelta(days=(index * 37) % 1000 - 30),
+                )
+                for drug in drugs for index in range(options['batches'])
+            ], batch_size=1000)
+            # Enough to span many batches of each drug
+            requested = {drug.id: options['batches'] for drug in drugs}
+
+            timings = []
+            for _ in range(options['rounds']):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    allocation, _ = allocate_order({}, requested)
+                    timings.append(time.perf_counter() - started)
+
+            timings.sort()
+            self.stdout.write(
+                f"{options['drugs']} drugs x {options['batches']} batches: "
+                f"{len(allocation)} batches allocated, {len(queries)} quer{'y' if len(queries) == 1 else 'ies'}, "
+                f"median {timings[len(timings) // 2] * 1000:.1f} ms, max {timings[-1] * 1000:.1f} ms"
+            )
+            transaction.set_rollback(True)
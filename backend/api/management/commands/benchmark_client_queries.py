@@ -0,0 +1,112 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from api.models import *
+from api.serializer import OrderValuesSerializer, DietPlanValuesSerializer
+from api.loaders import client_page_query, client_diet_plans
+
+# Models whose Meta.indexes serve the client_data access paths
+INDEXED_MODELS = [Consultation, Message, Order, OrderItem, DrugStock]
+
+
+# The queries client_data runs for the first page of each collection, built
+# by the same loaders so the benchmark measures what the view executes
+def client_queries(client, drug):
+    orders = client_page_query(client, 'orders')
+    return {
+        'consultations': client_page_query(client, 'consultations'),
+        'orders': orders,
+        'order_items': OrderValuesSerializer().item_rows([row['id'] for row in orders]),
+        'messages': client_page_query(client, 'messages'),
+        'diet_plans': DietPlanValuesSerializer().values(client_diet_plans(client)),
+        'drug_batches': DrugStock.objects.filter(drug=drug, expiry_date__gt=timezone.now().date()).order_by('expiry_date', 'id'),
+    }
+
+
+class Command(BaseCommand):
+    help = "Seed a large dataset and record EXPLAIN plans and timings of the client_data queries with and without the composite indexes. All rows are rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--rows', type=int, default=100, help="Consultations, orders, messages and diet plans per client")
+        parser.add_argument('--batches', type=int, default=2000, help="Stock batches of the benchmarked drug")
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument('--output', help="Write the plans and timings to this JSON file")
+
+    def seed(self, options):
+        today = timezone.now().date()
+        staff = Staff.objects.create(user=User.objects.create(username='benchmark-staff'), gender='Male', age=40)
+        drug = Drug.objects.create(name='Benchmark drug')
+        stocks = DrugStock.objects.bulk_create([
+            DrugStock(drug=drug, batch_number=f"BM{index}", name=drug.name, quantity=10, price=Decimal('1.00'), expiry_date=today + timedelta(days=index % 900 - 30))
+            for index in range(options['batches'])
+        ], batch_size=1000)
+        users = User.objects.bulk_create([User(username=f"benchmark-client-{index}") for index in range(options['clients'])], batch_size=1000)
+        clients = Client.objects.bulk_create([Client(user=user, address='Benchmark') for user in users], batch_size=1000)
+
+        rows = range(options['rows'])
+        Consultation.objects.bulk_create([
+            Consultation(client=client, staff=staff, type='new', date=today - timedelta(days=index)) for client in clients for index in rows
+        ], batch_size=1000)
+        Message.objects.bulk_create([Message(client=client, sender='user', message=f"Message {index}") for client in clients for index in rows], batch_size=1000)
+        DietPlan.objects.bulk_create([DietPlan(client=client, diet_type='regular') for client in clients for index in rows], batch_size=1000)
+        orders = Order.objects.bulk_create([Order(client=client, address='Benchmark', date=today) for client in clients for index in rows], batch_size=1000)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, drug=stocks[(order.id + index) % len(stocks)], quantity=1, price=Decimal('1.00'), total_price=Decimal('1.00'))
+            for order in orders for index in range(2)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return clients[len(clients) // 2], drug
+
+    # Times the SQL alone, so model instantiation does not hide the plan change
+    def measure(self, client, drug, rounds):
+        results = {}
+        for name, queryset in client_queries(client, drug).items():
+            sql, params = queryset.query.sql_with_params()
+            timings = []
+            with connection.cursor() as cursor:
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    timings.append(time.perf_counter() - started)
+            timings.sort()
+            results[name] = {'plan': queryset.explain(), 'median_ms': round(timings[len(timings) // 2] * 1000, 3)}
+        return results
+
+    # Drops the composite indexes, runs measure, and puts them back. Raw SQL
+    # keeps this inside the benchmark transaction on every backend.
+    def measure_without_indexes(self, client, drug, rounds):
+        schema_editor = connection.schema_editor()
+        indexes = [(model, index) for model in INDEXED_MODELS for index in model._meta.indexes]
+        with connection.cursor() as cursor:
+            for model, index in indexes:
+                cursor.execute(str(index.remove_sql(model, schema_editor)))
+            results = self.measure(client, drug, rounds)
+            for model, index in indexes:
+                cursor.execute(str(index.create_sql(model, schema_editor)))
+        return results
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            client, drug = self.seed(options)
+            report = {
+                'before': self.measure_without_indexes(client, drug, options['rounds']),
+                'after': self.measure(client, drug, options['rounds']),
+            }
+            transaction.set_rollback(True)
+
+        for name in report['after']:
+            before, after = report['before'][name], report['after'][name]
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {before['median_ms']} ms -> {after['median_ms']} ms"))
+            self.stdout.write(f"  before: {before['plan']}")
+            self.stdout.write(f"  after:  {after['plan']}")
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
@@ -0,0 +1,86 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from api.models import *
+from api.serializer import DrugValuesSerializer
+from api.loaders import load_client_bundle, catalog_drugs
+from api.renderers import ORJSONRenderer, MessagePackRenderer
+
+RENDERERS = {'drf_json': JSONRenderer, 'orjson': ORJSONRenderer, 'msgpack': MessagePackRenderer}
+
+
+class Command(BaseCommand):
+    help = "Seed a drug catalog and a client's activity and compare render time and size of the client/data payload with each renderer. All rows are rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drugs', type=int, default=2000)
+        parser.add_argument('--rows', type=int, default=50, help="Consultations, orders, messages and diet plans of the client")
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def seed(self, options):
+        today = timezone.now().date()
+        staff = Staff.objects.create(user=User.objects.create(username='benchmark-staff', first_name='Kofi', last_name='Asare'), gender='Male', age=40, languages=['English'])
+        client = Client.objects.create(user=User.objects.create(username='benchmark-client'), address='Benchmark')
+        drugs = Drug.objects.bulk_create([
+            Drug(name=f"Drug {index}", generic_name=f"Generic {index}", dosage_form=['tablet'], route=['oral'], active_ingredients=[f"Ingredient {index}"])
+            for index in range(options['drugs'])
+        ], batch_size=1000)
+        stocks = DrugStock.objects.bulk_create([
+            DrugStock(drug=drug, batch_number=f"BM{drug.id}-{index}", name=f"{drug.name} {index * 5 + 5}mg", quantity=10, price=Decimal('12.50'), expiry_date=today + timedelta(days=365))
+            for drug in drugs for index in range(2)
+        ], batch_size=1000)
+
+        rows = range(options['rows'])
+        Consultation.objects.bulk_create([
+            Consultation(client=client, staff=staff, name=f"Consultation {index}", type='new', date=today - timedelta(days=index), time=timezone.now().time())
+            for index in rows
+        ])
+        orders = Order.objects.bulk_create([Order(client=client, address='Benchmark', total_price=Decimal('25.00'), date=today) for index in rows])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, drug=stocks[index], quantity=2, price=Decimal('12.50'), total_price=Decimal('25.00'))
+            for index, order in enumerate(orders)
+        ])
+        Message.objects.bulk_create([Message(client=client, sender='user', message=f"Message {index}") for index in rows])
+        DietPlan.objects.bulk_create([
+            DietPlan(client=client, diet_type='regular', plans=[{'day': day, 'meals': {'breakfast': ['Oats', 'Tea']}, 'notes': 'Drink water'} for day in range(1, 8)])
+            for index in rows
+        ])
+        return client
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            client = self.seed(options)
+            payload = load_client_bundle(client)
+            payload['drugs'] = DrugValuesSerializer().serialize(catalog_drugs())
+            transaction.set_rollback(True)
+
+        report = {}
+        for name, renderer in RENDERERS.items():
+            timings = []
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                body = renderer().render(payload)
+                timings.append(time.perf_counter() - started)
+            report[name] = {
+                'render_ms': round(min(timings) * 1000, 3),
+                'bytes': len(body),
+                'gzip_bytes': len(gzip.compress(body)),
+            }
+
+        baseline = report['drf_json']
+        for name, result in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{name}: {result['render_ms']} ms ({round(baseline['render_ms'] / result['render_ms'], 2)}x), "
+                f"{result['bytes']} bytes ({result['gzip_bytes']} gzipped)"
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
@@ -0,0 +1,89 @@
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from api.models import *
+from api.serializer import *
+from api.loaders import catalog_drugs, client_consultations, client_orders, client_messages
+
+
+def payloads(client):
+    return {
+        'drugs': (catalog_drugs(), DrugSerializerOne, DrugValuesSerializer),
+        'consultations': (client_consultations(client), ConsultationSerializerOne, ConsultationValuesSerializer),
+        'orders': (client_orders(client), OrderSerializerOne, OrderValuesSerializer),
+        'messages': (client_messages(client), MessageSerializerOne, MessageValuesSerializer),
+    }
+
+
+class Command(BaseCommand):
+    help = "Seed ROWS drugs, consultations, orders and messages and compare the throughput of the DRF serializers and the .values() serializers on them. All rows are rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--output', help="Write the timings to this JSON file")
+
+    def seed(self, rows):
+        today = timezone.now().date()
+        staff = Staff.objects.create(user=User.objects.create(username='benchmark-staff', first_name='Kofi', last_name='Asare'), gender='Male', age=40, languages=['English'])
+        client = Client.objects.create(user=User.objects.create(username='benchmark-client'), address='Benchmark')
+        drugs = Drug.objects.bulk_create([
+            Drug(name=f"Drug {index}", generic_name=f"Generic {index}", dosage_form=['tablet'], route=['oral'], active_ingredients=[f"Ingredient {index}"], img=f"images/drug_images/{index}.png" if index % 2 else None)
+            for index in range(rows)
+        ], batch_size=1000)
+        stocks = DrugStock.objects.bulk_create([
+            DrugStock(drug=drug, batch_number=f"BM{drug.id}", name=drug.name, quantity=10, price=Decimal('1.25'), expiry_date=today + timedelta(days=365))
+            for drug in drugs
+        ], batch_size=1000)
+        Consultation.objects.bulk_create([
+            Consultation(client=client, staff=staff, name=f"Consultation {index}", type='new', date=today - timedelta(days=index % 365), time=timezone.now().time())
+            for index in range(rows)
+        ], batch_size=1000)
+        orders = Order.objects.bulk_create([
+            Order(client=client, address='Benchmark', total_price=Decimal('2.50'), date=today) for index in range(rows)
+        ], batch_size=1000)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, drug=stocks[index % len(stocks)], quantity=2, price=Decimal('1.25'), total_price=Decimal('2.50'))
+            for index, order in enumerate(orders)
+        ], batch_size=1000)
+        Message.objects.bulk_create([Message(client=client, sender='user', message=f"Message {index}") for index in range(rows)], batch_size=1000)
+        return client
+
+    def best_of(self, rounds, render):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            body = render()
+            timings.append(time.perf_counter() - started)
+        return min(timings), body
+
+    # Both sides read their rows from the database and render the JSON body,
+    # which is what the list endpoints do
+    def handle(self, *args, **options):
+        rows, rounds = options['rows'], options['rounds']
+        report = {}
+        with transaction.atomic():
+            client = self.seed(rows)
+            for name, (queryset, serializer, values_serializer) in payloads(client).items():
+                drf_seconds, drf_body = self.best_of(rounds, lambda: JSONRenderer().render(serializer(queryset.all(), many=True).data))
+                fast_seconds, fast_body = self.best_of(rounds, lambda: JSONRenderer().render(values_serializer().serialize(queryset.all())))
+                if drf_body != fast_body:
+                    raise CommandError(f"{name}: the .values() serializer output differs from {serializer.__name__}")
+                report[name] = {
+                    'drf_rows_per_second': round(rows / drf_seconds),
+                    'values_rows_per_second': round(rows / fast_seconds),
+                    'speedup': round(drf_seconds / fast_seconds, 2),
+                }
+            transaction.set_rollback(True)
+
+        for name, result in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {result['drf_rows_per_second']} -> {result['values_rows_per_second']} rows/s ({result['speedup']}x)"))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
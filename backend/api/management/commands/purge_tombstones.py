@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from api.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than CLIENT_SYNC_TOMBSTONE_DAYS"
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Deleted {purge_tombstones()} tombstones"))
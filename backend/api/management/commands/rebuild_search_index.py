@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Drug
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the drug full-text search index, e.g. after Drug rows were bulk created"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {Drug.objects.count()} drugs"))
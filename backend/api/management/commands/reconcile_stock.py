@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from api.stock import stock_drift, rebuild_quantities
+
+
+class Command(BaseCommand):
+    help = "Compare on-hand stock quantities with the stock ledger, and with --fix rebuild them from it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Set drifted quantities to their ledger totals")
+
+    def handle(self, *args, **options):
+        drift = rebuild_quantities() if options['fix'] else stock_drift()
+        for stock_id, (on_hand, ledger) in sorted(drift.items()):
+            self.stdout.write(f"Stock {stock_id}: on hand {on_hand}, ledger {ledger}")
+        negative = sorted(stock_id for stock_id, (_, ledger) in drift.items() if ledger < 0)
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Stock quantities match the ledger"))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(drift) - len(negative)} stock quantities from the ledger"))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} stock quantities differ from the ledger; run with --fix to rebuild them"))
+        if negative:
+            self.stdout.write(self.style.ERROR(f"Stock {', '.join(map(str, negative))} have a negative ledger and were not rebuilt; check their movements"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.diet import stale_diet_plans, fail_stale_diet_plans, get_diet_plan_executor, run_diet_plan_job
+
+
+class Command(BaseCommand):
+    help = "Generate again the diet plans left pending by a restart or deploy (pending longer than DIET_PLAN_STALE_AFTER), or mark them failed with --fail"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail', action='store_true', help="Mark the plans failed instead of generating them")
+
+    def handle(self, *args, **options):
+        if options['fail']:
+            self.stdout.write(self.style.SUCCESS(f"Marked {fail_stale_diet_plans()} diet plans failed"))
+            return
+
+        stale = stale_diet_plans()
+        diet_plan_ids = list(stale.values_list('id', flat=True))
+        # Fresh again, so status checks do not fail them while they run
+        stale.filter(id__in=diet_plan_ids).update(updated_at=timezone.now())
+        list(get_diet_plan_executor().map(run_diet_plan_job, diet_plan_ids))
+        self.stdout.write(self.style.SUCCESS(f"Generated {len(diet_plan_ids)} diet plans again"))
@@ -0,0 +1,79 @@
+from collections import namedtuple
+from django.conf import settings
+from api.models import Staff
+from api.text import tokenize, TfidfIndex
+from api.utils import get_cache_version, bump_cache_version
+
+STAFF_ROSTER_VERSION_KEY = 'staff_roster:version'
+
+# Conditions and services each specialization handles, so a booking purpose
+# written in plain words ("chest pain") reaches the right specialist
+SPECIALIZATION_KEYWORDS = {
+    'general practitioner': 'general checkup fever cold flu cough headache body pain malaria infection fatigue routine screening vaccination',
+    'cardiologist': 'heart chest pain palpitations blood pressure hypertension cholesterol cardiac circulation shortness breath',
+    'pediatrician': 'child children baby infant toddler kid newborn growth vaccination teen',
+    'dermatologist': 'skin rash acne eczema itch itching hair nails mole psoriasis allergy',
+    'dietitian': 'diet nutrition weight loss gain meal food obesity eating plan',
+    'psychologist': 'mental health stress anxiety depression sleep insomnia counseling therapy mood trauma grief',
+    'gynecologist': 'women pregnancy period menstrual fertility contraception pelvic reproductive prenatal',
+    'neurologist': 'brain nerve nerves migraine seizure epilepsy numbness stroke memory dizziness tremor',
+    'oncologist': 'cancer tumor lump chemotherapy oncology biopsy',
+    'pharmacist': 'medicine medication drug prescription dosage side effects refill',
+}
+SPECIALIZATION_WEIGHT = 3
+EXPERIENCE_BONUS = 0.002
+MAX_EXPERIENCE_YEARS = 30
+
+StaffMatch = namedtuple('StaffMatch', ['staff_id', 'score'])
+
+# (roster version, TF-IDF index, years of experience by staff id)
+_roster = (None, None, {})
+
+
+def bump_staff_roster_version():
+    bump_cache_version(STAFF_ROSTER_VERSION_KEY)
+
+
+def staff_document(staff):
+    specialization = (staff.specialization or '').strip().lower()
+    tokens = tokenize(specialization) * SPECIALIZATION_WEIGHT
+    tokens += tokenize(SPECIALIZATION_KEYWORDS.get(specialization, ''))
+    tokens += tokenize(staff.bio)
+    tokens += tokenize(' '.join(staff.languages or []))
+    return tokens
+
+
+def years_of_experience(staff):
+    try:
+        return min(int(str(staff.years_of_experience).strip()), MAX_EXPERIENCE_YEARS)
+    except ValueError:
+        return 0
+
+
+def get_roster_index():
+    global _roster
+    version = get_cache_version(STAFF_ROSTER_VERSION_KEY)
+    if _roster[0] != version:
+        staff = list(Staff.objects.only('id', 'specialization', 'bio', 'languages', 'years_of_experience'))
+        documents = {item.id: staff_document(item) for item in staff}
+        experience = {item.id: years_of_experience(item) for item in staff}
+        _roster = (version, TfidfIndex(documents), experience)
+    return _roster[1], _roster[2]
+
+
+def rank_staff(purpose, limit=5):
+    index, experience = get_roster_index()
+    ranked = [
+        StaffMatch(staff_id, score + experience.get(staff_id, 0) * EXPERIENCE_BONUS)
+        for staff_id, score in index.query(tokenize(purpose))
+    ]
+    return sorted(ranked, key=lambda match: match.score, reverse=True)[:limit]
+
+
+# Best staff member for a booking purpose, or None when no one clears
+# STAFF_MATCH_THRESHOLD and the caller should fall back to Gemini
+def match_staff(purpose):
+    ranked = rank_staff(purpose, limit=1)
+    if ranked and ranked[0].score >= settings.STAFF_MATCH_THRESHOLD:
+        return ranked[0]
+    return None
@@ -0,0 +1,10 @@
+from django.middleware.gzip import GZipMiddleware
+
+
+# GZipMiddleware buffers streamed responses inside the compressor, which
+# would hold back server-sent events until the stream ends
+class StreamingGZipMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+PG_DOCUMENT = """
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(generic_name, '') || ' ' || coalesce(brand, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(active_ingredients::text, '') || ' ' || coalesce(pharm_class::text, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(indications, '')), 'C')
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE api_drug ADD COLUMN search_vector tsvector")
+        schema_editor.execute("CREATE INDEX api_drug_search_gin ON api_drug USING GIN (search_vector)")
+        schema_editor.execute(f"UPDATE api_drug SET search_vector = {PG_DOCUMENT}")
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_drug_fts USING fts5("
+            "name, generic_name, brand, active_ingredients, pharm_class, indications, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            "INSERT INTO api_drug_fts (rowid, name, generic_name, brand, active_ingredients, pharm_class, indications) "
+            "SELECT id, name, generic_name, brand, active_ingredients, pharm_class, indications FROM api_drug"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS api_drug_search_gin")
+        schema_editor.execute("ALTER TABLE api_drug DROP COLUMN IF EXISTS search_vector")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS api_drug_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_alter_drug_manufacturer_alter_drug_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_drug_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='category',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Service Category'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0040_conversationsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dietplan',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=20, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_dietplan_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drugstock',
+            index=models.Index(fields=['drug', 'expiry_date'], name='drugstock_drug_expiry_idx'),
+        ),
+    ]
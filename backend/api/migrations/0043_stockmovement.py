@@ -0,0 +1,40 @@
+# Generated by Django 5.0 on 2026-10-18 13:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Existing quantities become the opening balance of the ledger
+def record_opening_balances(apps, schema_editor):
+    DrugStock = apps.get_model('api', 'DrugStock')
+    StockMovement = apps.get_model('api', 'StockMovement')
+    StockMovement.objects.bulk_create([
+        StockMovement(stock_id=stock_id, kind='adjustment', quantity=quantity, note='Opening balance')
+        for stock_id, quantity in DrugStock.objects.filter(quantity__gt=0).values_list('id', 'quantity')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_drugstock_drug_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('sale', 'Sale'), ('cancellation', 'Cancellation'), ('adjustment', 'Adjustment')], max_length=20, verbose_name='Kind')),
+                ('quantity', models.IntegerField(help_text='Positive when stock comes in, negative when it goes out.', verbose_name='Quantity')),
+                ('note', models.CharField(blank=True, max_length=200, null=True, verbose_name='Note')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='api.order', verbose_name='Order')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='api.drugstock', verbose_name='Stock')),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0045_sync_updated_at_and_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='category_source',
+            field=models.CharField(blank=True, choices=[('model', 'Local Model'), ('gemini', 'Gemini')], max_length=10, null=True, verbose_name='Category Source'),
+        ),
+    ]
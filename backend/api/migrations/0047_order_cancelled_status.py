@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0046_message_category_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], default='processing', max_length=20, verbose_name='Order Status'),
+        ),
+    ]
@@ -235,6 +235,10 @@ class Consultation(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['client', '-date'], name='consultation_client_date_idx'),
+            models.Index(fields=['client', 'updated_at'], name='consult_client_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client} - {self.staff} - {self.date} {self.time}"
@@ -258,6 +262,7 @@ class Drug(models.Model):
     is_prescription_required = models.BooleanField(default=True, verbose_name="Prescription Required?")
     img = models.ImageField(upload_to='images/drug_images/', blank=True, null=True, help_text="Uploaded image of the drug", storage=MediaCloudinaryStorage() if not settings.DEBUG else None)
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Updated At")
 
     def __str__(self):
         return self.name
@@ -275,6 +280,12 @@ class DrugStock(models.Model):
     expiry_date = models.DateField(verbose_name="Expiry Date")
     is_prescription_required = models.BooleanField(default=False, verbose_name="Prescription Required?")
     date_received = models.DateField(auto_now_add=True, verbose_name="Date Received")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Updated At")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['drug', 'expiry_date'], name='drugstock_drug_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"{self.drug.name} - Batch {self.batch_number}"
@@ -287,12 +298,18 @@ class Order(models.Model):
     ORDER_STATUS_CHOICES = [
         ('processing', 'Processing'),        
         ('delivered', 'Delivered'),
+        ('cancelled', 'Cancelled'),
     ]
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='processing', verbose_name="Order Status")
     date = models.DateField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['client', '-id'], name='order_client_id_idx'),
+            models.Index(fields=['client', 'updated_at'], name='order_client_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.client}"
@@ -309,9 +326,13 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     prescription_image = models.ImageField(upload_to='images/orders/prescriptions/', blank=True, null=True, storage=MediaCloudinaryStorage() if not settings.DEBUG else None)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['order', '-id'], name='orderitem_order_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.drug.name} (x{self.quantity})" if self.drug else f"Item #{self.id}"
@@ -323,20 +344,61 @@ class OrderItem(models.Model):
         self.save(update_fields=['total_price', 'price'])
 
 
+class StockMovement(models.Model):
+    KIND_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('sale', 'Sale'),
+        ('cancellation', 'Cancellation'),
+        ('adjustment', 'Adjustment'),
+    ]
+    stock = models.ForeignKey(DrugStock, on_delete=models.CASCADE, related_name='movements', verbose_name='Stock')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Kind')
+    quantity = models.IntegerField(verbose_name='Quantity', help_text="Positive when stock comes in, negative when it goes out.")
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='movements', verbose_name='Order')
+    note = models.CharField(max_length=200, blank=True, null=True, verbose_name='Note')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.quantity} ({self.stock_id})"
+
+
 class Message(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='messages')
     sender = models.CharField(verbose_name='Sender Name', max_length=200, blank=True, null=True)
     message = models.TextField(verbose_name='Message', blank=True, null=True)
+    category = models.PositiveSmallIntegerField(verbose_name='Service Category', blank=True, null=True)
+    CATEGORY_SOURCE_CHOICES = [
+        ('model', 'Local Model'),
+        ('gemini', 'Gemini'),
+    ]
+    category_source = models.CharField(max_length=10, choices=CATEGORY_SOURCE_CHOICES, blank=True, null=True, verbose_name='Category Source')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-id']
+        indexes = [
+            models.Index(fields=['client', 'id'], name='message_client_id_idx'),
+            models.Index(fields=['client', 'updated_at'], name='message_client_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client} - {self.sender}"
 
 
+class ConversationSummary(models.Model):
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, related_name='conversation_summary')
+    summary = models.TextField(verbose_name='Summary', blank=True, default='')
+    last_message_id = models.BigIntegerField(verbose_name='Last Summarized Message', default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.client} - summary up to #{self.last_message_id}"
+
+
 class DietPlan(models.Model):
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='diet_plans')
     goal = models.CharField(max_length=200, verbose_name="Diet Goal", blank=True, null=True)
@@ -353,5 +415,45 @@ class DietPlan(models.Model):
     activity_level = models.CharField(max_length=20, choices=ACTIVITY_LEVEL_CHOICES, default='sedentary', help_text="Your daily activity level.")
     preferred_foods = models.JSONField(verbose_name='Preferred Foods', blank=True, default=list, help_text="List foods you particularly enjoy (e.g., fruits, vegetables, specific cuisines).")
     plans = models.JSONField(verbose_name='Plans', blank=True, default=list)
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ready', verbose_name='Status')
     end_date = models.DateField(null=True, blank=True, verbose_name='End Date')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'updated_at'], name='dietplan_client_updated_idx'),
+        ]
+
+
+# Marks a deleted row so delta syncs can tell clients to drop it. client_id
+# is empty for rows every client sees, such as drugs; it is not a foreign key
+# because tombstones are written while a client's rows are being deleted.
+class Tombstone(models.Model):
+    collection = models.CharField(max_length=50, verbose_name='Collection')
+    object_id = models.BigIntegerField(verbose_name='Object ID')
+    client_id = models.BigIntegerField(null=True, blank=True, verbose_name='Client ID')
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client_id', 'deleted_at'], name='tombstone_client_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.collection} #{self.object_id}"
+
+
+# Named counters every worker must agree on, e.g. the versions of the cached
+# catalog and staff roster (see api.counters)
+class Counter(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name='Name')
+    value = models.BigIntegerField(default=0, verbose_name='Value')
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
@@ -0,0 +1,147 @@
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from api.models import *
+from api.stock import record_movements
+from api.loaders import client_orders
+
+
+class OrderUnavailable(Exception):
+    pass
+
+
+# Quantities ordered from specific stock rows ("id") and per drug
+# ("drug_id", split across batches by allocate_fefo). Items the client saw
+# as out of stock are skipped, and repeated items are merged.
+def order_quantities(order_items):
+    stock_quantities = defaultdict(int)
+    drug_quantities = defaultdict(int)
+    for item in order_items:
+        if int(item.get('quantity', 1)) == 0:
+            continue
+        quantity = int(item['order_quantity'])
+        if quantity <= 0:
+            raise OrderUnavailable('Order quantities must be at least 1')
+        if item.get('id') is not None:
+            stock_quantities[int(item['id'])] += quantity
+        else:
+            drug_quantities[int(item['drug_id'])] += quantity
+    return stock_quantities, drug_quantities
+
+
+Batch = namedtuple('Batch', ['id', 'drug_id', 'name', 'price', 'quantity', 'expiry_date'])
+
+
+# Every stock row the order can draw from, locked and read in one query:
+# the rows named explicitly plus the sellable batches of each drug ordered,
+# earliest expiry first (served by the drug/expiry_date index). Rows come
+# back as plain tuples since a drug can have thousands of batches.
+def candidate_batches(stock_ids, drug_ids):
+    batches = Q(id__in=stock_ids)
+    if drug_ids:
+        batches |= Q(drug_id__in=drug_ids, quantity__gt=0, expiry_date__gt=timezone.now().date(), price__isnull=False)
+    rows = (
+        DrugStock.objects.select_for_update()
+        .filter(batches)
+        .order_by('expiry_date', 'id')
+        .values_list(*Batch._fields)
+    )
+    return [Batch(*row) for row in rows]
+
+
+# Splits quantity across batches (already in expiry order), taking from the
+# earliest expiring batch first. Returns [(batch, quantity)] and what could
+# not be allocated, and updates remaining in place.
+def allocate_fefo(batches, quantity, remaining):
+    allocation = []
+    for batch in batches:
+        if quantity == 0:
+            break
+        taken = min(remaining[batch.id], quantity)
+        if taken:
+            allocation.append((batch, taken))
+            remaining[batch.id] -= taken
+            quantity -= taken
+    return allocation, quantity
+
+
+# Quantity to take from each stock row, and the rows themselves by id
+def allocate_order(stock_quantities, drug_quantities):
+    batches = candidate_batches(list(stock_quantities), list(drug_quantities))
+    remaining = {batch.id: batch.quantity for batch in batches}
+    stocks = {batch.id: batch for batch in batches}
+    allocation = defaultdict(int)
+
+    for stock_id, quantity in stock_quantities.items():
+        stock = stocks.get(stock_id)
+        if not stock or stock.price is None:
+            raise OrderUnavailable('An item in your order is no longer available')
+        if remaining[stock_id] < quantity:
+            raise OrderUnavailable(f"Only {remaining[stock_id]} of {stock.name} left in stock")
+        remaining[stock_id] -= quantity
+        allocation[stock_id] += quantity
+
+    today = timezone.now().date()
+    batches_by_drug = defaultdict(list)
+    for batch in batches:
+        if batch.price is not None and batch.quantity > 0 and batch.expiry_date > today:
+            batches_by_drug[batch.drug_id].append(batch)
+    for drug_id, quantity in drug_quantities.items():
+        drug_allocation, missing = allocate_fefo(batches_by_drug[drug_id], quantity, remaining)
+        if missing:
+            if not batches_by_drug[drug_id]:
+                raise OrderUnavailable('An item in your order is no longer available')
+            name = Drug.objects.filter(id=drug_id).values_list('name', flat=True).first()
+            raise OrderUnavailable(f"Only {quantity - missing} of {name} left in stock")
+        for batch, taken in drug_allocation:
+            allocation[batch.id] += taken
+    return allocation, stocks
+
+
+# Places the order in a constant number of queries. The stock rows are locked
+# before they are checked, and the sale movements are applied with a guard so
+# stock can never go negative, even on databases without row locks.
+def place_order(client, order_items):
+    stock_quantities, drug_quantities = order_quantities(order_items)
+    if not stock_quantities and not drug_quantities:
+        raise OrderUnavailable('Your order is empty')
+
+    with transaction.atomic():
+        allocation, stocks = allocate_order(stock_quantities, drug_quantities)
+        items = [
+            OrderItem(drug_id=stock_id, quantity=quantity, price=stocks[stock_id].price, total_price=stocks[stock_id].price * Decimal(quantity))
+            for stock_id, quantity in allocation.items()
+        ]
+        order = Order.objects.create(client=client, address=client.address, date=timezone.now().date(), total_price=sum(item.total_price for item in items))
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+
+        sales = [StockMovement(stock_id=stock_id, kind='sale', quantity=-quantity, order=order) for stock_id, quantity in allocation.items()]
+        if record_movements(sales, guard=True) != len(allocation):
+            raise OrderUnavailable('Some items in your order just sold out')
+        # Read back with its items before the commit, so nothing can fail
+        # between the order committing and the client hearing about it
+        return client_orders(client).get(id=order.id)
+
+
+# Marks the client's order cancelled and puts its items back in stock. The
+# order is kept so its sale and cancellation movements still point to it.
+# Only orders still processing can be cancelled, and only once.
+def cancel_order(client, order_id):
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id, client=client).first()
+        if not order:
+            return False
+        if order.status != 'processing':
+            raise OrderUnavailable('This order can no longer be cancelled')
+        items = order.items.filter(drug__isnull=False).values_list('drug_id', 'quantity')
+        record_movements([
+            StockMovement(stock_id=stock_id, kind='cancellation', quantity=quantity, order=order, note=f"Order #{order.id} cancelled")
+            for stock_id, quantity in items
+        ])
+        order.status = 'cancelled'
+        order.save(update_fields=['status', 'updated_at'])
+    return True
@@ -0,0 +1,82 @@
+import json
+import base64
+from datetime import date
+from django.db.models import F, Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Cursors are opaque to clients: the collection name and the sort key of the
+# last row served, as url-safe base64 JSON
+def encode_cursor(collection, key):
+    payload = json.dumps([collection, key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(collection, cursor):
+    try:
+        name, key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if name != collection or not isinstance(key, list):
+        raise InvalidCursor('Invalid cursor')
+    return key
+
+
+# How a collection is ordered newest first, the columns and key of a row
+# (as read with .values()) in that order, and the filter selecting the rows
+# that come after a key
+class Keyset:
+    def __init__(self, ordering, columns, key, older):
+        self.ordering = ordering
+        self.columns = columns
+        self.key = key
+        self.older = older
+
+
+def id_older(key):
+    if len(key) != 1 or not isinstance(key[0], int):
+        raise InvalidCursor('Invalid cursor')
+    return Q(id__lt=key[0])
+
+
+# Rows without a date sort after every dated row
+def date_older(key):
+    if len(key) != 2 or not isinstance(key[1], int):
+        raise InvalidCursor('Invalid cursor')
+    day, row_id = key
+    if day is None:
+        return Q(date__isnull=True, id__lt=row_id)
+    try:
+        day = date.fromisoformat(day)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+    return Q(date__lt=day) | Q(date=day, id__lt=row_id) | Q(date__isnull=True)
+
+
+ID_KEYSET = Keyset(['-id'], ['id'], lambda row: [row['id']], id_older)
+DATE_KEYSET = Keyset(
+    [F('date').desc(nulls_last=True), '-id'],
+    ['date', 'id'],
+    lambda row: [row['date'].isoformat() if row['date'] else None, row['id']],
+    date_older,
+)
+
+
+# The query of one page: the rows after cursor in keyset order, plus one to
+# tell whether another page follows
+def keyset_query(queryset, keyset, collection, cursor=None, page_size=20):
+    if cursor:
+        queryset = queryset.filter(keyset.older(decode_cursor(collection, cursor)))
+    return queryset.order_by(*keyset.ordering)[:page_size + 1]
+
+
+# One page of the queryset in keyset order, and the cursor of the next page
+# (None on the last one). Each page is a single indexed range scan, however
+# deep into the collection it is.
+def keyset_page(queryset, keyset, collection, cursor=None, page_size=20):
+    rows = list(keyset_query(queryset, keyset, collection, cursor, page_size))
+    next_cursor = encode_cursor(collection, keyset.key(rows[page_size - 1])) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
@@ -0,0 +1,39 @@
+import orjson
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Anything orjson or msgpack cannot encode themselves (Decimal, timedelta,
+# lazy strings, querysets, and dates and times for msgpack) is converted the
+# way DRF's own encoder does, so both formats carry the same values
+encode_default = JSONEncoder().default
+
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = ORJSON_OPTIONS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        body = orjson.dumps(data, default=encode_default, option=options)
+        # Escaped like JSONRenderer does, so the output is safe inside <script>
+        return body.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def msgpack_packer():
+    return msgpack.Packer(default=encode_default, use_bin_type=True, datetime=False)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack_packer().pack(data)
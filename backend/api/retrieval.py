@@ -0,0 +1,49 @@
+import json
+from django.conf import settings
+from django.utils import timezone
+from api.models import DrugStock
+from api.catalog import catalog_version
+from api.text import tokenize, TfidfIndex
+
+# Names count more than label text when ranking stock for a chat message
+NAME_WEIGHT = 3
+
+# ((catalog version, date), TF-IDF index, compact item by stock id)
+_stock_index = (None, None, {})
+
+
+def stock_document(stock):
+    drug = stock.drug
+    names = ' '.join([stock.name or '', drug.name or '', drug.generic_name or '', drug.brand or '', ' '.join(drug.active_ingredients or [])])
+    return tokenize(names) * NAME_WEIGHT + tokenize(drug.indications)
+
+
+def compact_stock(stock):
+    return {'name': stock.name, 'price': str(stock.price) if stock.price is not None else None, 'quantity': stock.quantity}
+
+
+def get_stock_index():
+    global _stock_index
+    today = timezone.now().date()
+    key = (catalog_version(), today)
+    if _stock_index[0] != key:
+        stocks = list(
+            DrugStock.objects.filter(quantity__gt=0, expiry_date__gt=today)
+            .select_related('drug')
+            .only('id', 'name', 'price', 'quantity', 'drug__name', 'drug__generic_name', 'drug__brand', 'drug__active_ingredients', 'drug__indications')
+        )
+        index = TfidfIndex({stock.id: stock_document(stock) for stock in stocks})
+        _stock_index = (key, index, {stock.id: compact_stock(stock) for stock in stocks})
+    return _stock_index[1], _stock_index[2]
+
+
+# The in-stock items most relevant to a chat message, at most
+# CHAT_MEDICINE_CONTEXT_SIZE of them
+def relevant_stock(text, limit=None):
+    index, items = get_stock_index()
+    ranked = index.query(tokenize(text), limit=limit or settings.CHAT_MEDICINE_CONTEXT_SIZE)
+    return [items[stock_id] for stock_id, _ in ranked]
+
+
+def medicine_context(text):
+    return json.dumps(relevant_stock(text), separators=(',', ':'))
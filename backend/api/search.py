@@ -0,0 +1,135 @@
+import re
+from bisect import bisect_left
+from difflib import get_close_matches
+from django.db import connection
+from api.models import Drug
+from api.catalog import catalog_version
+
+# Drug search is backed by a tsvector column with a GIN index on Postgres and
+# by an FTS5 table on SQLite; both are created by migration 0038 and kept in
+# sync from api.signals.
+PG_DOCUMENT = """
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(generic_name, '') || ' ' || coalesce(brand, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(active_ingredients::text, '') || ' ' || coalesce(pharm_class::text, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(indications, '')), 'C')
+"""
+FTS_TABLE = 'api_drug_fts'
+# bm25 weights for name, generic_name, brand, active_ingredients, pharm_class, indications
+FTS_WEIGHTS = '10.0, 6.0, 6.0, 3.0, 2.0, 1.0'
+MIN_FUZZY_TERM_LENGTH = 3
+MAX_TERMS = 8
+
+# (catalog version, sorted vocabulary) used to correct misspelled terms
+_vocabulary = (None, [])
+
+
+def index_drugs(drug_ids):
+    drug_ids = list(drug_ids)
+    if not drug_ids:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"UPDATE api_drug SET search_vector = {PG_DOCUMENT} WHERE id = ANY(%s)", [drug_ids])
+        elif connection.vendor == 'sqlite':
+            placeholders = ', '.join(['%s'] * len(drug_ids))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", drug_ids)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, generic_name, brand, active_ingredients, pharm_class, indications) "
+                f"SELECT id, name, generic_name, brand, active_ingredients, pharm_class, indications FROM api_drug WHERE id IN ({placeholders})",
+                drug_ids,
+            )
+
+
+def unindex_drugs(drug_ids):
+    drug_ids = list(drug_ids)
+    if not drug_ids or connection.vendor != 'sqlite':
+        # On Postgres the vector is a column of the deleted row
+        return
+    placeholders = ', '.join(['%s'] * len(drug_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", drug_ids)
+
+
+def rebuild_index():
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    index_drugs(Drug.objects.values_list('id', flat=True))
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", str(text or '').lower())
+
+
+def get_vocabulary():
+    global _vocabulary
+    version = catalog_version()
+    if _vocabulary[0] != version:
+        words = set()
+        for row in Drug.objects.values_list('name', 'generic_name', 'brand', 'active_ingredients', 'pharm_class'):
+            for value in row:
+                words.update(word for word in tokenize(value) if len(word) >= MIN_FUZZY_TERM_LENGTH)
+        _vocabulary = (version, sorted(words))
+    return _vocabulary[1]
+
+
+def has_prefix(vocabulary, term):
+    index = bisect_left(vocabulary, term)
+    return index < len(vocabulary) and vocabulary[index].startswith(term)
+
+
+# Returns the term followed by close spellings of it, so a typo still finds
+# the prefixes it was meant to type
+def expand_term(term, vocabulary):
+    if len(term) < MIN_FUZZY_TERM_LENGTH or has_prefix(vocabulary, term):
+        return [term]
+    prefixes = {word[:len(term)] for word in vocabulary if len(word) >= len(term)}
+    return [term] + get_close_matches(term, prefixes, n=3, cutoff=0.75)
+
+
+def build_query(text):
+    terms = tokenize(text)[:MAX_TERMS]
+    if not terms:
+        return None
+    vocabulary = get_vocabulary()
+    groups = [expand_term(term, vocabulary) for term in terms]
+    if connection.vendor == 'postgresql':
+        return ' & '.join('(' + ' | '.join(f"{term}:*" for term in group) + ')' for group in groups)
+    return ' AND '.join('(' + ' OR '.join(f'"{term}"*' for term in group) + ')' for group in groups)
+
+
+def search_drugs(text, limit=20, offset=0):
+    query = build_query(text)
+    if not query:
+        return [], 0
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT id, count(*) OVER () FROM api_drug, to_tsquery('english', %s) query "
+                "WHERE search_vector @@ query ORDER BY ts_rank(search_vector, query) DESC, id LIMIT %s OFFSET %s",
+                [query, limit, offset],
+            )
+        else:
+            cursor.execute(
+                f"SELECT id, count(*) OVER () FROM ("
+                f"SELECT rowid AS id, bm25({FTS_TABLE}, {FTS_WEIGHTS}) AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+                f") ORDER BY rank, id LIMIT %s OFFSET %s",
+                [query, limit, offset],
+            )
+        rows = cursor.fetchall()
+
+    if not rows:
+        total = 0 if offset == 0 else count_matches(query)
+        return [], total
+    return [row[0] for row in rows], rows[0][1]
+
+
+def count_matches(query):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT count(*) FROM api_drug WHERE search_vector @@ to_tsquery('english', %s)", [query])
+        else:
+            cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query])
+        return cursor.fetchone()[0]
@@ -1,5 +1,7 @@
 from pathlib import Path
+from collections import defaultdict
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from django.contrib.auth.models import User
 from django.conf import settings
 from backend.production import ALLOWED_HOSTS
@@ -125,12 +127,17 @@ class ConsultationSerializerOne(serializers.ModelSerializer):
 
 
 # Drug Serializers
+# Catalog list projection; the label text is served by DrugSerializerTwo
+DRUG_LIST_FIELDS = ['id', 'name', 'generic_name', 'brand', 'manufacturer', 'dosage_form', 'route', 'active_ingredients', 'is_prescription_required', 'img']
+DRUG_STOCK_LIST_FIELDS = ['id', 'drug_id', 'name', 'quantity', 'price', 'is_prescription_required']
+
+
 class DrugSerializerOne(serializers.ModelSerializer):
     stocks = serializers.SerializerMethodField()
     
     class Meta:
         model = Drug
-        exclude = ["created_at"]
+        fields = DRUG_LIST_FIELDS + ['stocks']
     
     def get_stocks(self, obj):
         return [{
@@ -148,6 +155,12 @@ class DrugSerializerOne(serializers.ModelSerializer):
         return data
 
 
+class DrugSerializerTwo(DrugSerializerOne):
+    class Meta:
+        model = Drug
+        exclude = ["created_at"]
+
+
 # Drug Stock Serializers
 class DrugStockSerializerOne(serializers.ModelSerializer):    
     class Meta:
@@ -184,4 +197,183 @@ class MessageSerializerOne(serializers.ModelSerializer):
 class DietPlanSerializerOne(serializers.ModelSerializer): 
     class Meta:
         model = DietPlan
-        exclude = ["client"]
\ No newline at end of file
+        exclude = ["client"]
+
+
+# Fast read paths
+# The classes below render rows read with .values() exactly as the matching
+# ModelSerializer renders model instances, but without a field tree per row.
+# Serializer fields whose column value already is their JSON form
+PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField, serializers.JSONField, serializers.ChoiceField, serializers.PrimaryKeyRelatedField)
+
+
+def values_converter(serializer, name):
+    field = serializer.fields[name]
+    if isinstance(field, serializers.FileField):
+        storage = serializer.Meta.model._meta.get_field(field.source).storage
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return lambda value: value or None
+        return lambda value: storage.url(value) if value else None
+    if isinstance(field, PLAIN_FIELDS):
+        return None
+    return field.to_representation
+
+
+# serializer_class gives the fields and their order. Fields in nested are
+# rendered by another ValuesSerializer from the joined columns, fields in
+# computed by get_<name>(row) from the listed columns, and every other
+# field straight from its own column. prepare() can load related rows for a
+# whole page at once.
+class ValuesSerializer:
+    serializer_class = None
+    nested = {}
+    computed = {}
+
+    def __init__(self, fields=None, prefix=''):
+        serializer = self.serializer_class()
+        self.prefix = prefix
+        self.names = [name for name in serializer.fields if fields is None or name in fields]
+        self.renderers = []
+        self.paths = [prefix + 'id']
+        for name in self.names:
+            if name in self.nested:
+                nested = self.nested[name](prefix=f"{prefix}{name}__")
+                self.renderers.append((name, None, nested.to_nested))
+                self.paths += nested.paths
+            elif name in self.computed:
+                self.renderers.append((name, None, getattr(self, f"get_{name}")))
+                self.paths += [prefix + x for x in self.computed[name]]
+            else:
+                path = prefix + serializer.fields[name].source
+                self.renderers.append((name, path, values_converter(serializer, name)))
+                self.paths.append(path)
+        self.paths = list(dict.fromkeys(self.paths))
+
+    def values(self, queryset, extra=()):
+        return queryset.prefetch_related(None).values(*dict.fromkeys([*extra, *self.paths]))
+
+    def prepare(self, rows):
+        pass
+
+    def to_representation(self, row):
+        data = {}
+        for name, path, convert in self.renderers:
+            if path is None:
+                data[name] = convert(row)
+            else:
+                value = row[path]
+                data[name] = convert(value) if convert and value is not None else value
+        return data
+
+    def to_nested(self, row):
+        return None if row[self.prefix + 'id'] is None else self.to_representation(row)
+
+    def render(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        return [self.to_representation(row) for row in rows]
+
+    def serialize(self, queryset):
+        return self.render(self.values(queryset))
+
+
+class StaffImageFileValuesSerializer(ValuesSerializer):
+    serializer_class = StaffImageFileSerializer
+
+    def to_representation(self, row):
+        data = super().to_representation(row)
+        data['url'] = get_file_url(data, 'url')
+
+        return data
+
+
+class StaffValuesSerializer(ValuesSerializer):
+    serializer_class = StaffSerializerOne
+    nested = {'img': StaffImageFileValuesSerializer}
+    computed = {'user': ['user__first_name', 'user__last_name']}
+
+    def get_user(self, row):
+        return f"Dr. {row[self.prefix + 'user__first_name']} {row[self.prefix + 'user__last_name']}"
+
+    def to_representation(self, row):
+        data = super().to_representation(row)
+        if not data['img']:
+            data['img'] = get_default_image('staff_img')
+
+        return data
+
+
+class ConsultationValuesSerializer(ValuesSerializer):
+    serializer_class = ConsultationSerializerOne
+    nested = {'staff': StaffValuesSerializer}
+    computed = {'follow_up': ['follow_up', 'follow_up__name']}
+
+    def get_follow_up(self, row):
+        return {
+            'id': row[self.prefix + 'follow_up'],
+            'name': row[self.prefix + 'follow_up__name'],
+        } if row[self.prefix + 'follow_up'] else None
+
+
+class DrugValuesSerializer(ValuesSerializer):
+    serializer_class = DrugSerializerOne
+    computed = {'stocks': []}
+
+    def prepare(self, rows):
+        self.stocks = defaultdict(list)
+        if 'stocks' not in self.names or not rows:
+            return
+        stocks = (
+            DrugStock.objects.filter(drug_id__in=[row['id'] for row in rows]).order_by('id')
+            .values_list('drug_id', 'id', 'name', 'quantity', 'price', 'is_prescription_required')
+        )
+        for drug_id, stock_id, name, quantity, price, is_prescription_required in stocks:
+            self.stocks[drug_id].append({
+                'id': stock_id,
+                'name': name,
+                'quantity': quantity,
+                'price': float(price) * 10,
+                'is_prescription_required': is_prescription_required,
+            })
+
+    def get_stocks(self, row):
+        return self.stocks[row['id']]
+
+    def to_representation(self, row):
+        data = super().to_representation(row)
+        if 'img' in data:
+            data['img'] = get_file_url(data, 'img')
+
+        return data
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    serializer_class = OrderSerializerOne
+    computed = {'items': []}
+
+    def prepare(self, rows):
+        self.items = defaultdict(list)
+        if 'items' not in self.names or not rows:
+            return
+        for order_id, item_id, drug_id, drug_name, quantity, price, total_price in self.item_rows([row['id'] for row in rows]):
+            self.items[order_id].append({
+                'id': item_id,
+                'drug': {'id': drug_id, 'name': drug_name} if drug_id else None,
+                'quantity': quantity,
+                'price': price,
+                'total_price': total_price,
+            })
+
+    def item_rows(self, order_ids):
+        return OrderItem.objects.filter(order_id__in=order_ids).values_list('order_id', 'id', 'drug_id', 'drug__name', 'quantity', 'price', 'total_price')
+
+    def get_items(self, row):
+        return self.items[row['id']]
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    serializer_class = MessageSerializerOne
+
+
+class DietPlanValuesSerializer(ValuesSerializer):
+    serializer_class = DietPlanSerializerOne
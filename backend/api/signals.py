@@ -0,0 +1,73 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
+from django.dispatch import receiver
+from api.models import Drug, DrugStock, Staff, StockMovement, Consultation, Order, Message, DietPlan, Tombstone
+from api.catalog import bump_catalog_version
+from api.search import index_drugs, unindex_drugs
+from api.matching import bump_staff_roster_version
+
+
+@receiver([post_save, post_delete], sender=Drug)
+@receiver([post_save, post_delete], sender=DrugStock)
+def invalidate_drug_catalog(sender, **kwargs):
+    bump_catalog_version()
+
+
+# Quantities set through save() (new batches, admin edits) go in the stock
+# ledger too; order placement and cancellation write theirs via api.stock
+@receiver(pre_save, sender=DrugStock)
+def remember_stock_quantity(sender, instance, raw=False, **kwargs):
+    if instance.id and not raw:
+        instance._saved_quantity = DrugStock.objects.filter(id=instance.id).values_list('quantity', flat=True).first()
+
+
+@receiver(post_save, sender=DrugStock)
+def record_stock_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    change = instance.quantity - (0 if created else getattr(instance, '_saved_quantity', None) or 0)
+    if change:
+        StockMovement.objects.create(stock=instance, kind='receipt' if created else 'adjustment', quantity=change)
+
+
+@receiver(post_save, sender=Drug)
+def update_drug_search_index(sender, instance, **kwargs):
+    index_drugs([instance.id])
+
+
+@receiver(post_delete, sender=Drug)
+def remove_drug_search_index(sender, instance, **kwargs):
+    unindex_drugs([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Staff)
+def invalidate_staff_roster(sender, **kwargs):
+    bump_staff_roster_version()
+
+
+# Tombstones let client/data?since=... report deletions
+TOMBSTONE_COLLECTIONS = {
+    Consultation: 'consultations',
+    Order: 'orders',
+    Message: 'messages',
+    DietPlan: 'diet_plans',
+}
+
+
+@receiver(post_delete, sender=Consultation)
+@receiver(post_delete, sender=Order)
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=DietPlan)
+def record_client_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(collection=TOMBSTONE_COLLECTIONS[sender], object_id=instance.id, client_id=instance.client_id)
+
+
+@receiver(post_delete, sender=Drug)
+def record_drug_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(collection='drugs', object_id=instance.id)
+
+
+# A drug's catalog entry lists its stocks, so losing one changes the drug
+@receiver(post_delete, sender=DrugStock)
+def touch_stock_drug(sender, instance, **kwargs):
+    Drug.objects.filter(id=instance.drug_id).update(updated_at=timezone.now())
@@ -0,0 +1,68 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Sum, Value
+from django.utils import timezone
+from api.models import DrugStock, StockMovement
+from api.catalog import bump_catalog_version
+
+
+def movement_deltas(movements):
+    deltas = defaultdict(int)
+    for movement in movements:
+        deltas[movement.stock_id] += movement.quantity
+    return {stock_id: delta for stock_id, delta in deltas.items() if delta}
+
+
+# Writes the movements to the ledger and applies them to the on-hand
+# quantities in one UPDATE. With guard=True a row only changes while it still
+# holds enough stock; returns the number of stock rows updated so the caller
+# can roll back when some were not. Must run inside a transaction.
+def record_movements(movements, guard=False):
+    StockMovement.objects.bulk_create(movements)
+    deltas = movement_deltas(movements)
+    if not deltas:
+        return 0
+
+    rows = Q(id__in=list(deltas))
+    if guard:
+        rows = Q()
+        for stock_id, delta in deltas.items():
+            rows |= Q(id=stock_id, quantity__gte=-delta) if delta < 0 else Q(id=stock_id)
+    updated = DrugStock.objects.filter(rows).update(
+        quantity=F('quantity') + Case(*[When(id=stock_id, then=Value(delta)) for stock_id, delta in deltas.items()]),
+        updated_at=timezone.now(),
+    )
+    # update() skips the post_save signal that keeps the catalog fresh
+    bump_catalog_version()
+    return updated
+
+
+def ledger_quantities():
+    return dict(StockMovement.objects.order_by().values('stock_id').annotate(total=Sum('quantity')).values_list('stock_id', 'total'))
+
+
+# Stock rows whose on-hand quantity disagrees with their ledger, as
+# {stock id: (on hand, ledger)}
+def stock_drift():
+    ledger = ledger_quantities()
+    return {
+        stock_id: (quantity, ledger.get(stock_id, 0))
+        for stock_id, quantity in DrugStock.objects.values_list('id', 'quantity')
+        if quantity != ledger.get(stock_id, 0)
+    }
+
+
+# Sets each drifted on-hand quantity back to its ledger total and returns the
+# drift it found. A negative ledger means movements are missing, so those rows
+# are left as they are and stay in the drift for someone to look into.
+def rebuild_quantities():
+    with transaction.atomic():
+        drift = stock_drift()
+        fixable = {stock_id: ledger for stock_id, (_, ledger) in drift.items() if ledger >= 0}
+        if fixable:
+            DrugStock.objects.filter(id__in=list(fixable)).update(
+                quantity=Case(*[When(id=stock_id, then=Value(ledger)) for stock_id, ledger in fixable.items()]),
+                updated_at=timezone.now(),
+            )
+            bump_catalog_version()
+    return drift
@@ -0,0 +1,63 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from api.models import *
+from api.serializer import *
+from api.loaders import client_consultations, client_orders, client_messages, client_diet_plans, catalog_drugs, CLIENT_SECTIONS, SECTION_SERIALIZERS
+from api.pagination import encode_cursor, decode_cursor, InvalidCursor
+
+def sync_token(moment):
+    return encode_cursor('sync', [moment.isoformat()])
+
+
+def read_sync_token(token):
+    key = decode_cursor('sync', token)
+    try:
+        moment = datetime.fromisoformat(key[0])
+    except (IndexError, TypeError, ValueError):
+        raise InvalidCursor('Invalid sync token')
+    if timezone.is_naive(moment):
+        raise InvalidCursor('Invalid sync token')
+    return moment
+
+
+# Tombstones are only kept for CLIENT_SYNC_TOMBSTONE_DAYS, so older tokens
+# need a full reload
+def sync_token_expired(since):
+    return since < timezone.now() - timedelta(days=settings.CLIENT_SYNC_TOMBSTONE_DAYS)
+
+
+def purge_tombstones():
+    cutoff = timezone.now() - timedelta(days=settings.CLIENT_SYNC_TOMBSTONE_DAYS)
+    return Tombstone.objects.filter(deleted_at__lt=cutoff).delete()[0]
+
+
+# Rows created, updated or deleted since the sync token was issued, for the
+# requested sections. The window reaches CLIENT_SYNC_OVERLAP seconds further
+# back so rows committed by transactions that were still open at that moment
+# are not missed; clients apply the changes by id, so repeats are harmless.
+def load_client_changes(client, since, sections=None, fields=None):
+    sections, fields = sections or CLIENT_SECTIONS, fields or {}
+    after = since - timedelta(seconds=settings.CLIENT_SYNC_OVERLAP)
+    changed_items = OrderItem.objects.filter(order__client=client, updated_at__gt=after).values('order_id')
+    changed_stocks = DrugStock.objects.filter(updated_at__gt=after).values('drug_id')
+    changes = {
+        'consultations': lambda: client_consultations(client).filter(updated_at__gt=after),
+        'orders': lambda: client_orders(client).filter(Q(updated_at__gt=after) | Q(id__in=changed_items)),
+        'messages': lambda: client_messages(client).filter(updated_at__gt=after),
+        'diet_plans': lambda: client_diet_plans(client).filter(updated_at__gt=after),
+        'drugs': lambda: catalog_drugs().filter(Q(updated_at__gt=after) | Q(id__in=changed_stocks)),
+    }
+
+    data = {}
+    for section in sections:
+        data[section] = SECTION_SERIALIZERS[section](fields.get(section)).serialize(changes[section]())
+
+    deleted = defaultdict(list)
+    tombstones = Tombstone.objects.filter(Q(client_id=client.id) | Q(client_id__isnull=True), deleted_at__gt=after, collection__in=sections)
+    for collection, object_id in tombstones.values_list('collection', 'object_id'):
+        deleted[collection].append(object_id)
+    data['deleted'] = {section: deleted[section] for section in sections}
+    return data
@@ -1,3 +1,1331 @@
-from django.test import TestCase
+import re
+import json
+import threading
+import gzip
+import zlib
+import brotli
+import msgpack
+from io import StringIO
+from time import sleep
+from datetime import date, time, timedelta
+from decimal import Decimal
+from unittest import mock
+from google.api_core import exceptions as google_exceptions
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.models import *
+from api.catalog import get_catalog, catalog_version, bump_catalog_version, CATALOG_VERSION_KEY
+from api.compression import compress, choose_encoding
+from api.renderers import ORJSONRenderer
+from api.serializer import *
+from api.loaders import catalog_drugs, client_consultations, client_orders, client_messages, client_diet_plans
+from api.pagination import encode_cursor
+from api.sync import sync_token
+from api.matching import match_staff
+from api import intents
+from api.chat import build_history, history_window, update_conversation_summary
+from api.retrieval import relevant_stock, medicine_context
+from api.diet import run_diet_plan_job, validate_chunk, generate_chunk, generate_chunked_plans
+from api.stock import stock_drift, rebuild_quantities
+from api.management.commands.benchmark_client_queries import client_queries
+from api.gemini import GeminiGateway, GeminiUnavailable, submit_gemini_task, cached_generate, gemini_cache_stats, count_cache_lookup
 
-# Create your tests here.
+
+def create_client(username='client@example.com'):
+    user = User.objects.create_user(username=username, password='password', first_name='Ama', last_name='Mensah')
+    return Client.objects.create(user=user, address='35 Aviation Road', nationality='Ghanaian', gender='Female', age=30)
+
+
+def create_staff(username='staff@example.com', specialization='General Practitioner'):
+    user = User.objects.create_user(username=username, password='password', first_name='Kofi', last_name='Asare')
+    staff = Staff.objects.create(user=user, gender='Male', age=40, specialization=specialization, languages=['English'])
+    staff.img = StaffImageFile.objects.create(staff=staff, filename='staff.jpg', url='staff.jpg')
+    staff.save()
+    return staff
+
+
+def create_drug(name='Lexapro', stocks=2, quantity=50, price='10.00'):
+    drug = Drug.objects.create(name=name, generic_name=name.upper(), brand=name)
+    for index in range(stocks):
+        DrugStock.objects.create(
+            drug=drug,
+            batch_number=f"BN{index}",
+            name=f"{name} {index}",
+            quantity=quantity,
+            price=Decimal(price),
+            expiry_date=date.today() + timedelta(days=180 + index),
+        )
+    return drug
+
+
+def seed_client_activity(client, staff, size):
+    previous = None
+    for index in range(size):
+        previous = Consultation.objects.create(
+            client=client,
+            staff=staff,
+            name=f"Consultation {index}",
+            date=date.today(),
+            time=time(9, 0),
+            type='follow_up' if previous else 'new',
+            follow_up=previous,
+        )
+        drug = create_drug(name=f"Drug {client.id}-{index}")
+        order = Order.objects.create(client=client, address=client.address, date=date.today())
+        for stock in drug.stocks.all():
+            OrderItem.objects.create(order=order, drug=stock, quantity=1, price=stock.price, total_price=stock.price)
+        Message.objects.create(client=client, sender='user', message=f"Message {index}")
+        DietPlan.objects.create(client=client, diet_type='regular', goal='Lose weight')
+
+
+class ClientDataQueryBudgetTest(TestCase):
+    # client, consultations, orders + items, messages, diet plans; the drug catalog is served warm
+    QUERY_BUDGET = 6
+
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.staff = create_staff()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def assert_budget(self):
+        get_catalog()
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.api.get('/client/data')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_query_count_is_constant(self):
+        seed_client_activity(self.client_obj, self.staff, 2)
+        small = self.assert_budget()
+        seed_client_activity(self.client_obj, self.staff, 20)
+        large = self.assert_budget()
+
+        self.assertEqual(len(small['orders']), 2)
+        self.assertEqual(len(large['orders']), 20)
+        self.assertEqual(len(large['consultations']), 20)
+        self.assertEqual(large['consultations'][0]['staff']['user'], 'Dr. Kofi Asare')
+
+    def test_bundle_shape(self):
+        seed_client_activity(self.client_obj, self.staff, 3)
+        data = self.assert_budget()
+        follow_ups = [item['follow_up'] for item in data['consultations'] if item['follow_up']]
+        self.assertEqual(len(follow_ups), 2)
+        self.assertEqual(len(data['orders'][0]['items']), 2)
+        self.assertEqual(set(data['orders'][0]['items'][0]['drug']), {'id', 'name'})
+        self.assertEqual(len(data['drugs'][0]['stocks']), 2)
+        self.assertEqual([item['message'] for item in data['messages']], ['Message 0', 'Message 1', 'Message 2'])
+
+
+class ClientCollectionPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.staff = create_staff()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def walk(self, collection, cursor, page_size):
+        pages = []
+        while cursor:
+            with self.assertNumQueries(2 if collection != 'orders' else 3):
+                response = self.api.get(f"/client/collection/{collection}", {'cursor': cursor, 'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data['results'])
+            cursor = response.data['next_cursor']
+        return pages
+
+    @override_settings(CLIENT_PAGE_SIZE=3)
+    def test_dashboard_serves_latest_page_and_cursors_reach_the_rest(self):
+        for index in range(8):
+            Message.objects.create(client=self.client_obj, sender='user', message=f"Message {index}")
+        data = self.api.get('/client/data').json()
+        self.assertEqual([item['message'] for item in data['messages']], ['Message 5', 'Message 6', 'Message 7'])
+        self.assertIsNone(data['cursors']['orders'])
+
+        pages = self.walk('messages', data['cursors']['messages'], 3)
+        self.assertEqual([[item['message'] for item in page] for page in pages], [['Message 2', 'Message 3', 'Message 4'], ['Message 0', 'Message 1']])
+
+    @override_settings(CLIENT_PAGE_SIZE=2)
+    def test_consultations_page_by_date_then_id(self):
+        days = [date.today(), date.today(), None, date.today() - timedelta(days=3), date.today() + timedelta(days=2)]
+        for index, day in enumerate(days):
+            Consultation.objects.create(client=self.client_obj, staff=self.staff, name=f"C{index}", type='new', date=day)
+        data = self.api.get('/client/data').json()
+        names = [item['name'] for item in data['consultations']]
+        for page in self.walk('consultations', data['cursors']['consultations'], 2):
+            names += [item['name'] for item in page]
+        self.assertEqual(names, ['C4', 'C1', 'C0', 'C3', 'C2'])
+
+    def test_bad_cursors_are_rejected(self):
+        orders_cursor = encode_cursor('orders', [10])
+        for collection, cursor in [('messages', 'not-a-cursor'), ('messages', orders_cursor), ('orders', encode_cursor('orders', ['x']))]:
+            response = self.api.get(f"/client/collection/{collection}", {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.get('/client/collection/diet_plans').status_code, 404)
+
+
+@override_settings(CLIENT_SYNC_OVERLAP=0)
+class ClientDeltaSyncTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.staff = create_staff()
+        seed_client_activity(self.client_obj, self.staff, 3)
+        self.other_drug = create_drug(name='Advil', stocks=2)
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+        self.token = self.api.get('/client/data').json()['sync_token']
+
+    def sync(self, token=None):
+        response = self.api.get('/client/data', {'since': token or self.token})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_steady_state_refresh_is_small_and_cheap(self):
+        # client, consultations, orders, messages, diet plans, drugs, tombstones
+        with self.assertNumQueries(7):
+            data = self.sync()
+        for collection in ['consultations', 'orders', 'messages', 'diet_plans', 'drugs']:
+            self.assertEqual(data[collection], [])
+            self.assertEqual(data['deleted'][collection], [])
+        self.assertNotEqual(data['sync_token'], self.token)
+
+    def test_changes_and_deletions_since_token(self):
+        Message.objects.create(client=self.client_obj, sender='user', message='New message')
+        Message.objects.create(client=create_client('other@example.com'), sender='user', message='Not mine')
+        consultation = Consultation.objects.filter(client=self.client_obj).first()
+        consultation_id = consultation.id
+        consultation.delete()
+        stock = self.other_drug.stocks.first()
+        items = [{'id': stock.id, 'quantity': stock.quantity, 'order_quantity': 1}]
+        order = self.api.post('/client/data', {'type': 'placeOrder', 'orderItems': json.dumps(items)}).data
+        deleted_drug_id = Drug.objects.exclude(id=self.other_drug.id).first().id
+        Drug.objects.filter(id=deleted_drug_id).delete()
+
+        data = self.sync()
+        self.assertEqual([item['message'] for item in data['messages']], ['New message'])
+        self.assertEqual(data['deleted']['consultations'], [consultation_id])
+        self.assertEqual([item['id'] for item in data['orders']], [order['id']])
+        self.assertEqual([item['name'] for item in data['drugs']], ['Advil'])
+        self.assertEqual(data['drugs'][0]['stocks'][0]['quantity'], 49)
+        self.assertEqual(data['deleted']['drugs'], [deleted_drug_id])
+
+        self.assertEqual(self.sync(data['sync_token'])['messages'], [])
+
+    def test_invalid_and_expired_tokens(self):
+        self.assertEqual(self.api.get('/client/data', {'since': 'garbage'}).status_code, 400)
+        expired = sync_token(timezone.now() - timedelta(days=31))
+        data = self.sync(expired)
+        self.assertIn('cursors', data)
+        self.assertEqual(len(data['consultations']), 3)
+
+
+@override_settings(CLIENT_SYNC_OVERLAP=0)
+class ClientDataSelectionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        seed_client_activity(self.client_obj, create_staff(), 3)
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def test_only_included_sections_are_loaded(self):
+        # client, messages
+        with self.assertNumQueries(2):
+            response = self.api.get('/client/data', {'include': 'messages'})
+        data = json.loads(response.content)
+        self.assertEqual(set(data), {'messages', 'cursors', 'sync_token'})
+        self.assertEqual(len(data['messages']), 3)
+
+    def test_sparse_fields_drive_the_select_list(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/client/data', {'include': 'drugs,orders', 'fields[drugs]': 'id,name', 'fields[orders]': 'total_price'})
+        data = json.loads(response.content)
+        self.assertEqual(set(data['drugs'][0]), {'id', 'name'})
+        self.assertEqual(set(data['orders'][0]), {'total_price'})
+        drug_sql = next(x['sql'] for x in queries.captured_queries if 'FROM "api_drug"' in x['sql'])
+        self.assertNotIn('description', drug_sql)
+        self.assertFalse(any('api_orderitem' in x['sql'] for x in queries.captured_queries))
+
+        token = data['sync_token']
+        Message.objects.create(client=self.client_obj, sender='user', message='New message')
+        changes = self.api.get('/client/data', {'since': token, 'include': 'messages', 'fields[messages]': 'message'}).json()
+        self.assertEqual(changes['messages'], [{'message': 'New message'}])
+        self.assertEqual(set(changes['deleted']), {'messages'})
+
+    def test_unknown_sections_and_fields_are_rejected(self):
+        self.assertEqual(self.api.get('/client/data', {'include': 'secrets'}).status_code, 400)
+        self.assertEqual(self.api.get('/client/data', {'fields[drugs]': 'id,cost'}).status_code, 400)
+        self.assertEqual(self.api.get('/client/collection/messages', {'fields[messages]': 'nope'}).status_code, 400)
+
+
+class DrugCatalogSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+        self.drug = create_drug(stocks=1, quantity=50)
+
+    def test_catalog_is_built_once(self):
+        # The catalog version, the drugs and their stocks
+        with self.assertNumQueries(3):
+            first = get_catalog()
+        with self.assertNumQueries(0):
+            self.assertIs(get_catalog(), first)
+
+        data = self.api.get('/client/data').json()
+        self.assertEqual(data['drugs'][0]['name'], 'Lexapro')
+        self.assertEqual(data['drugs'][0]['stocks'][0]['quantity'], 50)
+        self.assertEqual(set(data), {'consultations', 'drugs', 'orders', 'messages', 'diet_plans', 'cursors', 'sync_token'})
+
+    def test_catalog_is_rebuilt_after_stock_change(self):
+        get_catalog()
+        stock = self.drug.stocks.get()
+        stock.quantity = 10
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.save(update_fields=['quantity'])
+        data = self.api.get('/client/data').json()
+        self.assertEqual(data['drugs'][0]['stocks'][0]['quantity'], 10)
+
+    def test_catalog_is_rebuilt_after_drug_delete(self):
+        get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drug.delete()
+        self.assertEqual(self.api.get('/client/data').json()['drugs'], [])
+
+
+class RendererTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        seed_client_activity(self.client_obj, create_staff(), 2)
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def test_orjson_matches_drf_json(self):
+        data = {'price': Decimal('12.50'), 'day': date(2025, 6, 1), 'at': time(9, 30), 'text': 'Akwaaba \u2028 \u20b5', 1: [None, True]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_msgpack_is_negotiated_by_accept_header(self):
+        json_data = self.api.get('/client/data').json()
+        response = self.api.get('/client/data', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content)
+        self.assertNotEqual(data.pop('sync_token'), None)
+        json_data.pop('sync_token')
+        self.assertEqual(data, json_data)
+
+        response = self.api.get('/client/collection/messages', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'][0]['message'], 'Message 0')
+
+    def test_benchmark_reports_each_renderer(self):
+        out = StringIO()
+        call_command('benchmark_renderers', drugs=5, rows=2, rounds=1, stdout=out)
+        for name in ['drf_json', 'orjson', 'msgpack']:
+            self.assertIn(f"{name}: ", out.getvalue())
+        self.assertEqual(Drug.objects.count(), 2)
+
+
+class PrecompressedCatalogTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.drug = create_drug(stocks=2)
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def test_catalog_variants_are_compressed_once_per_version(self):
+        with mock.patch('api.catalog.compress', wraps=compress) as compressed:
+            for _ in range(2):
+                br = self.api.get('/client/drug/catalog', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+                gzipped = self.api.get('/client/drug/catalog', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+            self.assertEqual(compressed.call_count, 2)
+            self.assertEqual(br['Content-Encoding'], 'br')
+            self.assertIn('Accept-Encoding', br['Vary'])
+            self.assertEqual(brotli.decompress(br.content), get_catalog())
+            self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(gzipped.content), get_catalog())
+
+            self.drug.stocks.update(quantity=10)
+            bump_catalog_version()
+            br = self.api.get('/client/drug/catalog', HTTP_ACCEPT_ENCODING='br')
+            self.assertEqual(compressed.call_count, 3)
+            self.assertIn(b'"quantity":10', brotli.decompress(br.content))
+
+        plain = self.api.get('/client/drug/catalog')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain.content, get_catalog())
+
+    def test_explicit_refusals_win_over_the_wildcard(self):
+        request = RequestFactory().get('/client/drug/catalog', HTTP_ACCEPT_ENCODING='br;q=0, *')
+        self.assertEqual(choose_encoding(request), 'gzip')
+        request = RequestFactory().get('/client/drug/catalog', HTTP_ACCEPT_ENCODING='br;q=0, gzip;q=0, *')
+        self.assertIsNone(choose_encoding(request))
+        request = RequestFactory().get('/client/drug/catalog', HTTP_ACCEPT_ENCODING='*')
+        self.assertEqual(choose_encoding(request), 'br')
+
+    def test_client_data_splices_the_compressed_catalog(self):
+        seed_client_activity(self.client_obj, create_staff(), 2)
+        plain = self.api.get('/client/data').json()
+        response = self.api.get('/client/data', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data.pop('sync_token') is not None, plain.pop('sync_token') is not None)
+        self.assertEqual(data, plain)
+
+        response = self.api.get('/client/data', HTTP_ACCEPT='application/msgpack', HTTP_ACCEPT_ENCODING='gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = msgpack.unpackb(decompressor.decompress(response.content) + decompressor.flush())
+        self.assertTrue(decompressor.eof)
+        self.assertEqual(data['drugs'], plain['drugs'])
+
+
+class SharedCounterTest(TestCase):
+    def test_catalog_version_lives_in_the_database(self):
+        version = catalog_version()
+        bump_catalog_version()
+        bump_catalog_version()
+        cache.clear()
+        self.assertEqual(Counter.objects.get(name=CATALOG_VERSION_KEY).value, version + 2)
+        self.assertEqual(catalog_version(), version + 2)
+
+    def test_version_bumps_are_a_single_atomic_update(self):
+        bump_catalog_version()
+        with CaptureQueriesContext(connection) as queries:
+            bump_catalog_version()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"value" = ("api_counter"."value" + 1)', queries[0]['sql'])
+
+    def test_llm_counters_are_database_rows(self):
+        count_cache_lookup('message_intent', 'hits')
+        count_cache_lookup('message_intent', 'hits')
+        caches['llm'].clear()
+        self.assertEqual(Counter.objects.get(name='gemini_stats:message_intent:hits').value, 2)
+        self.assertEqual(gemini_cache_stats()['message_intent']['hits'], 2)
+
+    @override_settings(CACHES={**settings.CACHES, 'llm': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lru-test', 'OPTIONS': {'MAX_ENTRIES': 3}}})
+    def test_llm_cache_evicts_the_least_recently_used_response(self):
+        model = PromptRouter([('first', 'one'), ('second', 'two'), ('third', 'three'), ('fourth', 'four')])
+        with mock.patch('api.gemini.get_gemini', return_value=create_gateway(model)):
+            for prompt in ['first', 'second', 'third', 'first', 'fourth', 'first', 'second']:
+                cached_generate(prompt, 'message_intent')
+        self.assertEqual(model.prompts, ['first', 'second', 'third', 'fourth', 'second'])
+
+
+class DrugDetailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+        self.drug = create_drug(stocks=1)
+        self.drug.description = 'Selective serotonin reuptake inhibitor'
+        self.drug.warnings = 'Suicidal thoughts and behaviors'
+        self.drug.save()
+
+    def test_catalog_omits_label_text(self):
+        drug = self.api.get('/client/data').json()['drugs'][0]
+        self.assertEqual(drug['name'], 'Lexapro')
+        self.assertEqual(len(drug['stocks']), 1)
+        for field in ['description', 'warnings', 'precautions', 'side_effects', 'indications']:
+            self.assertNotIn(field, drug)
+
+    def test_detail_returns_label_text(self):
+        response = self.api.get(f"/client/drug/{self.drug.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['warnings'], 'Suicidal thoughts and behaviors')
+        self.assertEqual(len(response.json()['stocks']), 1)
+        self.assertEqual(self.api.get('/client/drug/0').status_code, 404)
+
+
+class DrugSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+        self.lexapro = create_drug(name='Lexapro', stocks=1)
+        self.lexapro.generic_name = 'ESCITALOPRAM'
+        self.lexapro.active_ingredients = ['ESCITALOPRAM OXALATE']
+        self.lexapro.indications = 'Treatment of major depressive disorder'
+        self.lexapro.save()
+        self.zoloft = create_drug(name='Zoloft', stocks=1)
+        self.zoloft.generic_name = 'SERTRALINE'
+        self.zoloft.indications = 'Major depressive disorder and panic disorder'
+        self.zoloft.save()
+        self.advil = create_drug(name='Advil', stocks=1)
+        self.advil.generic_name = 'IBUPROFEN'
+        self.advil.indications = 'Temporarily relieves minor aches and pains'
+        self.advil.save()
+
+    def search(self, query, **params):
+        response = self.api.get('/client/drug/search', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ranks_name_matches_above_indications(self):
+        Drug.objects.filter(id=self.advil.id).update(indications='Not for use with Zoloft')
+        self.advil.refresh_from_db()
+        self.advil.save()
+        data = self.search('zoloft')
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([drug['name'] for drug in data['results']], ['Zoloft', 'Advil'])
+
+    def test_prefix_and_field_matches(self):
+        self.assertEqual([drug['name'] for drug in self.search('escital')['results']], ['Lexapro'])
+        self.assertEqual({drug['name'] for drug in self.search('depressive')['results']}, {'Lexapro', 'Zoloft'})
+        self.assertEqual(self.search('')['count'], 0)
+
+    def test_typo_tolerant_autocomplete(self):
+        response = self.api.get('/client/drug/autocomplete', {'q': 'sertarl'})
+        self.assertEqual([drug['name'] for drug in response.json()], ['Zoloft'])
+        response = self.api.get('/client/drug/autocomplete', {'q': 'ibu'})
+        self.assertEqual([drug['name'] for drug in response.json()], ['Advil'])
+
+    def test_pagination(self):
+        first = self.search('disorder', page_size=1)
+        second = self.search('disorder', page_size=1, page=2)
+        self.assertEqual(first['count'], 2)
+        self.assertEqual(len(first['results']), 1)
+        self.assertNotEqual(first['results'][0]['id'], second['results'][0]['id'])
+
+    def test_index_follows_deletes(self):
+        self.zoloft.delete()
+        self.assertEqual(self.search('zoloft')['count'], 0)
+
+
+class FakeGeminiModel:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def generate_content(self, prompt, request_options=None):
+        self.calls.append(request_options)
+        if len(self.calls) <= self.failures:
+            raise google_exceptions.ServiceUnavailable('unavailable')
+        return mock.Mock(text=f"reply to {prompt}")
+
+
+def create_gateway(model, max_retries=2, max_concurrency=2, acquire_timeout=0):
+    with mock.patch('api.gemini.genai.configure'):
+        gateway = GeminiGateway('key', 'models/test', timeout=5, max_retries=max_retries, backoff=0, max_backoff=0, max_concurrency=max_concurrency, acquire_timeout=acquire_timeout)
+    gateway._models['models/test'] = model
+    return gateway
+
+
+class GeminiGatewayTest(TestCase):
+
+    def test_retries_transient_errors_with_timeout(self):
+        model = FakeGeminiModel(failures=2)
+        self.assertEqual(create_gateway(model).generate('hi'), 'reply to hi')
+        self.assertEqual(model.calls, [{'timeout': 5, 'retry': None}] * 3)
+
+    def test_gives_up_after_max_retries(self):
+        model = FakeGeminiModel(failures=5)
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            create_gateway(model, max_retries=1).generate('hi')
+        self.assertEqual(len(model.calls), 2)
+
+    def test_caps_requests_in_flight(self):
+        gateway = create_gateway(FakeGeminiModel(), max_concurrency=1)
+        gateway._slots.acquire()
+        with self.assertRaises(GeminiUnavailable):
+            gateway.generate('hi')
+        gateway._slots.release()
+        self.assertEqual(gateway.generate('hi'), 'reply to hi')
+
+    def test_pool_tasks_close_database_connections(self):
+        calls = []
+        with mock.patch('api.gemini.close_old_connections', side_effect=lambda: calls.append('close')):
+            result = submit_gemini_task(lambda value: calls.append(value) or value, 'task').result(timeout=5)
+        self.assertEqual(result, 'task')
+        self.assertEqual(calls, ['close', 'task', 'close'])
+
+
+class GeminiResponseCacheTest(TestCase):
+    def setUp(self):
+        caches['llm'].clear()
+        self.gateway = create_gateway(FakeGeminiModel())
+        patcher = mock.patch('api.gemini.get_gemini', return_value=self.gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_normalized_prompts_share_an_entry(self):
+        self.assertEqual(cached_generate('Name this  consultation:\n headache', 'consultation_name'), 'reply to Name this  consultation:\n headache')
+        self.assertEqual(cached_generate(' Name this consultation: headache ', 'consultation_name'), 'reply to Name this  consultation:\n headache')
+        self.assertEqual(len(self.gateway.model().calls), 1)
+        self.assertEqual(gemini_cache_stats()['consultation_name'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_model_name_is_part_of_the_key(self):
+        self.gateway._models['models/other'] = FakeGeminiModel()
+        cached_generate('hello', 'message_intent')
+        cached_generate('hello', 'message_intent', model_name='models/other')
+        self.assertEqual(gemini_cache_stats()['message_intent']['misses'], 2)
+
+
+class PromptRouter:
+    """Fake Gemini model that answers each prompt from the first matching rule."""
+
+    def __init__(self, rules, barrier=None):
+        self.rules = rules
+        self.barrier = barrier
+        self.prompts = []
+
+    def generate_content(self, prompt, request_options=None, stream=False):
+        self.prompts.append(prompt)
+        if self.barrier:
+            self.barrier.wait()
+        reply = ''
+        for marker, answer in self.rules:
+            if marker in prompt:
+                if isinstance(answer, Exception):
+                    raise answer
+                reply = answer
+                break
+        if stream:
+            return [mock.Mock(text=word) for word in reply.split('|')]
+        return mock.Mock(text=reply.replace('|', ''))
+
+
+# Local matching is disabled so the Gemini fallback path is exercised
+@override_settings(STAFF_MATCH_THRESHOLD=10)
+class CreateConsultationTest(TestCase):
+    def setUp(self):
+        caches['llm'].clear()
+        self.client_obj = create_client()
+        self.staff = create_staff()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def use_model(self, model):
+        gateway = create_gateway(model)
+        for target in ['api.utils.get_gemini', 'api.gemini.get_gemini']:
+            patcher = mock.patch(target, return_value=gateway)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def book(self):
+        data_obj = json.dumps({'date': '2026-11-02', 'time': '10:00', 'purpose': 'Recurring chest pain'})
+        return self.api.post('/client/data', {'type': 'createConsultation', 'dataObj': data_obj})
+
+    def test_prompts_are_in_flight_together(self):
+        # Both prompts must reach the model before either can return
+        self.use_model(PromptRouter([('Give me a name', 'Chest Pain Review'), ('select the most suitable staff', str(self.staff.id))], barrier=threading.Barrier(2, timeout=5)))
+        response = self.book()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Chest Pain Review')
+        self.assertEqual(response.json()['staff']['user'], 'Dr. Kofi Asare')
+
+    def test_naming_failure_uses_default_name(self):
+        self.use_model(PromptRouter([('Give me a name', ValueError('bad response')), ('select the most suitable staff', str(self.staff.id))]))
+        response = self.book()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'New Consultation')
+
+    def test_matching_failure_reports_no_doctors(self):
+        self.use_model(PromptRouter([('Give me a name', 'Chest Pain Review'), ('select the most suitable staff', '0')]))
+        response = self.book()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('no available Doctors', response.json()['message'])
+        self.assertFalse(Consultation.objects.exists())
+
+
+class StaffMatchingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['llm'].clear()
+        self.cardiologist = create_staff('cardio@example.com', 'Cardiologist')
+        self.dermatologist = create_staff('derm@example.com', 'Dermatologist')
+        self.psychologist = create_staff('psych@example.com', 'Psychologist')
+        self.psychologist.languages = ['English', 'Twi']
+        self.psychologist.save()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def test_matches_purpose_to_specialization(self):
+        self.assertEqual(match_staff('Chest pain and high blood pressure').staff_id, self.cardiologist.id)
+        self.assertEqual(match_staff('Itchy rash on my arms').staff_id, self.dermatologist.id)
+        self.assertEqual(match_staff('Stress and anxiety, prefer Twi').staff_id, self.psychologist.id)
+        self.assertIsNone(match_staff('Quarterly xyz review'))
+
+    def test_roster_index_follows_staff_changes(self):
+        self.assertIsNone(match_staff('Child vaccination'))
+        with self.captureOnCommitCallbacks(execute=True):
+            pediatrician = create_staff('kids@example.com', 'Pediatrician')
+        self.assertEqual(match_staff('Child vaccination').staff_id, pediatrician.id)
+
+    def test_booking_skips_gemini_matching(self):
+        model = PromptRouter([('Give me a name', 'Heart Checkup')])
+        gateway = create_gateway(model)
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.gemini.get_gemini', return_value=gateway):
+            data_obj = json.dumps({'date': '2026-11-02', 'time': '10:00', 'purpose': 'Heart palpitations'})
+            response = self.api.post('/client/data', {'type': 'createConsultation', 'dataObj': data_obj})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Consultation.objects.get().staff, self.cardiologist)
+        self.assertEqual(len(model.prompts), 1)
+
+
+class IntentClassifierTest(TestCase):
+    def setUp(self):
+        intents._model = (0, None)
+        self.addCleanup(setattr, intents, '_model', (0, None))
+        caches['llm'].clear()
+
+    def test_classifies_common_requests(self):
+        self.assertEqual(intents.classify_message('I want to book an appointment with a doctor'), 1)
+        self.assertEqual(intents.classify_message('Do you have amoxicillin tablets in stock?'), 2)
+        self.assertEqual(intents.classify_message('Give me a meal plan to lose weight'), 3)
+        self.assertEqual(intents.classify_message("I feel stressed and I can't sleep"), 4)
+        self.assertEqual(intents.classify_message('Is moringa a good natural remedy?'), 5)
+        self.assertIsNone(intents.classify_message('qwerty zxcv'))
+
+    def test_learns_from_labelled_history(self):
+        self.assertIsNone(intents.classify_message('sickle cell clinic'))
+        client = create_client()
+        for text in ['sickle cell clinic slot', 'sickle cell review', 'clinic slot for sickle cell']:
+            Message.objects.create(client=client, sender='user', message=text, category=1, category_source='gemini')
+        intents._model = (0, None)
+        self.assertEqual(intents.classify_message('sickle cell clinic'), 1)
+
+    def test_send_message_skips_intent_prompt(self):
+        client = create_client()
+        api = APIClient()
+        api.force_authenticate(client.user)
+        model = PromptRouter([('You are Cassandra', 'You can order it from our e-pharmacy.')])
+        gateway = create_gateway(model)
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.gemini.get_gemini', return_value=gateway):
+            response = api.post('/client/data', {'type': 'sendMessage', 'clientData': '{}', 'history': '', 'message': 'Please deliver paracetamol tablets'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(model.prompts), 1)
+        self.assertNotIn('Return the **service number only**', model.prompts[0])
+        self.assertEqual(Message.objects.get(sender='user').category, 2)
+        self.assertEqual(Message.objects.get(sender='user').category_source, 'model')
+
+    def test_gemini_labels_are_marked_for_training(self):
+        client = create_client()
+        api = APIClient()
+        api.force_authenticate(client.user)
+        model = PromptRouter([('Return the **service number only**', '1.'), ('You are Cassandra', 'Which day suits you?')])
+        gateway = create_gateway(model)
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.gemini.get_gemini', return_value=gateway):
+            response = api.post('/client/data', {'type': 'sendMessage', 'clientData': '{}', 'history': '', 'message': 'sickle cell clinic'})
+        self.assertEqual(response.status_code, 200)
+        message = Message.objects.get(sender='user')
+        self.assertEqual((message.category, message.category_source), (1, 'gemini'))
+
+    def test_ignores_its_own_labels(self):
+        client = create_client()
+        for text in ['sickle cell clinic slot', 'sickle cell review', 'clinic slot for sickle cell']:
+            Message.objects.create(client=client, sender='user', message=text, category=1, category_source='model')
+        self.assertIsNone(intents.classify_message('sickle cell clinic'))
+
+
+class ChatStreamTest(TestCase):
+    def setUp(self):
+        caches['llm'].clear()
+        self.client_obj = create_client()
+        self.model = PromptRouter([('You are Cassandra', 'You can |order it |from our e-pharmacy.')])
+        gateway = create_gateway(self.model)
+        for target in ['api.utils.get_gemini', 'api.gemini.get_gemini']:
+            patcher = mock.patch(target, return_value=gateway)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.token = str(RefreshToken.for_user(self.client_obj.user).access_token)
+
+    async def post(self, token):
+        response = await self.async_client.post(
+            '/client/chat/stream',
+            {'clientData': '{}', 'history': '', 'message': 'Please deliver paracetamol tablets'},
+            headers={'Authorization': f"Bearer {token}"},
+        )
+        if not response.streaming:
+            return response, []
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = [
+            (block.split('\n')[0].removeprefix('event: '), json.loads(block.split('\n')[1].removeprefix('data: ')))
+            for block in body.strip().split('\n\n')
+        ]
+        return response, events
+
+    async def test_streams_tokens_then_saves_messages(self):
+        response, events = await self.post(self.token)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual([event for event, _ in events], ['token', 'token', 'token', 'done'])
+        self.assertEqual(''.join(data['text'] for event, data in events[:-1]), 'You can order it from our e-pharmacy.')
+        user_message, reply = events[-1][1]
+        self.assertEqual(reply['message'], 'You can order it from our e-pharmacy.')
+        self.assertEqual(await Message.objects.filter(client=self.client_obj).acount(), 2)
+
+    async def test_requires_authentication(self):
+        response, _ = await self.post('invalid')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(CHAT_HISTORY_TOKEN_BUDGET=60, CHAT_HISTORY_MAX_MESSAGES=20, CHAT_SUMMARY_MIN_BATCH=4)
+class ConversationHistoryTest(TestCase):
+    def setUp(self):
+        caches['llm'].clear()
+        self.client_obj = create_client()
+        for index in range(12):
+            Message.objects.create(client=self.client_obj, sender='user' if index % 2 == 0 else 'cassandra', message=f"turn {index} " + 'word ' * 8)
+
+    def test_window_fits_the_token_budget(self):
+        window = history_window(self.client_obj)
+        self.assertLessEqual(sum(len(message['message']) for message in window) // 4, 60)
+        history = build_history(self.client_obj)
+        self.assertIn('turn 11', history)
+        self.assertNotIn('turn 0 ', history)
+        self.assertEqual(history.splitlines()[-1].split(':')[0], 'cassandra')
+
+    def test_evicted_turns_are_folded_into_the_summary_once(self):
+        model = PromptRouter([('running summary', 'Patient asked about turns 0 to 7.')])
+        gateway = create_gateway(model)
+        with mock.patch('api.utils.get_gemini', return_value=gateway):
+            update_conversation_summary(self.client_obj.id)
+            update_conversation_summary(self.client_obj.id)
+        self.assertEqual(len(model.prompts), 1)
+        self.assertIn('turn 0 ', model.prompts[0])
+        self.assertNotIn('turn 11', model.prompts[0])
+
+        summary = ConversationSummary.objects.get(client=self.client_obj)
+        window_start = Message.objects.filter(client=self.client_obj, id__gt=summary.last_message_id).order_by('id').first()
+        self.assertIn(window_start.message.split(' word')[0], build_history(self.client_obj))
+        self.assertTrue(build_history(self.client_obj).startswith('Summary of earlier conversations: Patient asked about turns 0 to 7.'))
+
+    @override_settings(CHAT_SUMMARY_MIN_BATCH=10)
+    def test_waits_for_a_minimum_batch_of_evicted_turns(self):
+        model = PromptRouter([('running summary', 'Patient asked about turns 0 to 7.')])
+        with mock.patch('api.utils.get_gemini', return_value=create_gateway(model)):
+            update_conversation_summary(self.client_obj.id)
+        self.assertEqual(model.prompts, [])
+        self.assertEqual(ConversationSummary.objects.get(client=self.client_obj).last_message_id, 0)
+
+    @override_settings(CHAT_SUMMARY_BATCH=3, CHAT_SUMMARY_MIN_BATCH=2)
+    def test_backlog_is_folded_oldest_first_in_batches(self):
+        model = PromptRouter([('running summary', 'Patient asked about earlier turns.')])
+        with mock.patch('api.utils.get_gemini', return_value=create_gateway(model)):
+            update_conversation_summary(self.client_obj.id)
+        self.assertEqual(len(model.prompts), 3)
+        self.assertIn('turn 0 ', model.prompts[0])
+        self.assertIn('turn 2 ', model.prompts[0])
+        self.assertNotIn('turn 3 ', model.prompts[0])
+        self.assertIn('turn 6 ', model.prompts[2])
+        self.assertIn('Patient asked about earlier turns.', model.prompts[1])
+        summary = ConversationSummary.objects.get(client=self.client_obj)
+        window_start = Message.objects.filter(client=self.client_obj, id__gt=summary.last_message_id).order_by('id').first()
+        self.assertIn(window_start.message.split(' word')[0], build_history(self.client_obj))
+
+    def test_prompt_ignores_posted_history(self):
+        api = APIClient()
+        api.force_authenticate(self.client_obj.user)
+        model = PromptRouter([('You are Cassandra', 'Noted.')])
+        gateway = create_gateway(model)
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.gemini.get_gemini', return_value=gateway):
+            response = api.post('/client/data', {'type': 'sendMessage', 'clientData': '{}', 'history': 'posted history', 'message': 'Please deliver paracetamol tablets'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('posted history', model.prompts[-1])
+        self.assertIn('turn 11', model.prompts[-1])
+
+    @override_settings(CHAT_SUMMARY_MIN_BATCH=10)
+    def test_evicted_turns_are_sent_until_they_are_folded(self):
+        window = history_window(self.client_obj)
+        history = build_history(self.client_obj)
+        for message in Message.objects.filter(client=self.client_obj, id__lt=window[0]['id']):
+            self.assertIn(message.message.split(' word')[0] + ' ', history)
+
+    def test_overlapping_summary_job_does_not_overwrite_the_summary(self):
+        def finish_other_job(prompt):
+            ConversationSummary.objects.filter(client=self.client_obj).update(summary='Folded by the other job.', last_message_id=F('last_message_id') + 4)
+            return 'Folded twice.'
+        with mock.patch('api.chat.send_prompt_to_gemini', side_effect=finish_other_job) as send:
+            update_conversation_summary(self.client_obj.id)
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(ConversationSummary.objects.get(client=self.client_obj).summary, 'Folded by the other job.')
+
+
+@override_settings(CHAT_MEDICINE_CONTEXT_SIZE=2)
+class MedicineContextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name, generic_name, indications in [
+            ('Advil', 'IBUPROFEN', 'Temporarily relieves minor aches, pains and fever'),
+            ('Zoloft', 'SERTRALINE', 'Major depressive disorder'),
+            ('Ventolin', 'ALBUTEROL', 'Treatment of asthma and bronchospasm'),
+            ('Amoxil', 'AMOXICILLIN', 'Bacterial infections of the ear, nose and throat'),
+        ]:
+            drug = create_drug(name=name, stocks=1)
+            drug.generic_name, drug.indications = generic_name, indications
+            drug.save()
+        expired = DrugStock.objects.get(drug__name='Amoxil')
+        expired.expiry_date = date.today() - timedelta(days=1)
+        expired.save()
+
+    def test_returns_only_relevant_in_stock_items(self):
+        self.assertEqual([item['name'] for item in relevant_stock('Do you have ibuprofen for a fever?')], ['Advil 0'])
+        self.assertEqual([item['name'] for item in relevant_stock('my asthma inhaler ran out')], ['Ventolin 0'])
+        self.assertEqual(relevant_stock('sore throat infection'), [])
+        self.assertEqual(relevant_stock('hello there'), [])
+
+    def test_context_is_compact_and_bounded(self):
+        context = json.loads(medicine_context('ibuprofen sertraline albuterol'))
+        self.assertEqual(len(context), 2)
+        self.assertEqual(set(context[0]), {'name', 'price', 'quantity'})
+        with self.assertNumQueries(0):
+            medicine_context('ibuprofen')
+
+
+class ChunkedPlanModel:
+    """Fake Gemini model answering diet plan chunk prompts with valid days, except
+    for the first broken[first_day] attempts at a chunk."""
+
+    def __init__(self, broken=None, barrier=None, delay=0):
+        self.broken = dict(broken or {})
+        self.barrier = barrier
+        self.delay = delay
+        self.prompts = []
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, prompt, request_options=None, stream=False):
+        first_day, last_day = [int(x) for x in re.search(r"days (\d+) to (\d+)", prompt).groups()]
+        with self.lock:
+            self.prompts.append(first_day)
+            broken = self.broken.get(first_day, 0) > 0
+            if broken:
+                self.broken[first_day] -= 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.barrier and not broken:
+            self.barrier.wait()
+        sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        if broken:
+            return mock.Mock(text='[{"day": ' + str(first_day) + ', "meals": ')
+        days = [{'day': day, 'meals': {'lunch': [f"Meal {day}"]}, 'notes': ''} for day in range(first_day, last_day + 1)]
+        return mock.Mock(text=json.dumps(days))
+
+
+class ImmediateExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+
+class DietPlanJobTest(TestCase):
+    def setUp(self):
+        caches['llm'].clear()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+        self.plan_data = {'goal': 'weight_loss', 'diet_type': 'balanced', 'duration_days': 2, 'meal_types': ['breakfast'], 'activity_level': 'sedentary', 'preferred_foods': 'rice, beans'}
+
+    def create_plan(self, reply, api=None, **changes):
+        api = api or self.api
+        self.model = model = PromptRouter([('diet plan', reply)])
+        gateway = create_gateway(model, max_retries=0)
+        pusher = mock.Mock()
+        with mock.patch('api.utils.get_gemini', return_value=gateway), \
+                mock.patch('api.diet.get_diet_plan_executor', return_value=ImmediateExecutor()), \
+                mock.patch('api.diet.use_pusher', return_value=pusher):
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = api.post('/client/data', {'type': 'createDietPlan', 'dataObj': json.dumps(dict(self.plan_data, **changes))})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data['status'], 'pending')
+            self.assertEqual(len(model.prompts), 0)
+            for callback in callbacks:
+                callback()
+        return response.data['id'], pusher
+
+    def test_plan_is_generated_in_background_and_pushed(self):
+        plans = [{'day': 1, 'meals': {'breakfast': ['Oats']}}, {'day': 2, 'meals': {'breakfast': ['Eggs']}}]
+        diet_plan_id, pusher = self.create_plan('```json\n' + json.dumps(plans) + '\n```')
+        diet_plan = DietPlan.objects.get(id=diet_plan_id)
+        self.assertEqual(diet_plan.status, 'ready')
+        self.assertEqual(diet_plan.preferred_foods, ['rice', 'beans'])
+        self.assertEqual([day['meals'] for day in diet_plan.plans], [day['meals'] for day in plans])
+        channel, event, payload = pusher.trigger.call_args.args
+        self.assertEqual((channel, event), (f"client_{self.client_obj.id}", 'diet_plan'))
+        self.assertEqual(payload, {'id': diet_plan_id, 'status': 'ready'})
+
+        response = self.api.get(f"/client/diet_plan/{diet_plan_id}/status")
+        self.assertEqual(response.data['status'], 'ready')
+        self.assertEqual(response.data['diet_plan']['plans'], diet_plan.plans)
+
+    def test_unparseable_reply_marks_plan_failed(self):
+        diet_plan_id, pusher = self.create_plan('Sorry, I cannot help with that.')
+        self.assertEqual(DietPlan.objects.get(id=diet_plan_id).status, 'failed')
+        self.assertEqual(pusher.trigger.call_args.args[2]['status'], 'failed')
+        response = self.api.get(f"/client/diet_plan/{diet_plan_id}/status")
+        self.assertEqual(response.data, {'id': diet_plan_id, 'status': 'failed'})
+
+    def test_status_is_private_and_finished_jobs_are_not_rerun(self):
+        diet_plan = DietPlan.objects.create(client=self.client_obj, duration_days=1, status='ready', plans=[{'day': 1}])
+        other = APIClient()
+        other.force_authenticate(create_client('other@example.com').user)
+        self.assertEqual(other.get(f"/client/diet_plan/{diet_plan.id}/status").status_code, 404)
+        with mock.patch('api.diet.send_prompt_to_gemini') as send:
+            run_diet_plan_job(diet_plan.id)
+        send.assert_not_called()
+
+    def test_equivalent_profiles_reuse_a_rebased_template(self):
+        plans = [{'day': 1, 'date': '2025-06-01', 'meals': {'breakfast': ['Oats']}, 'notes': 'Well done on day one, Ama.'}, {'day': 2, 'date': '2025-06-02', 'meals': {'breakfast': ['Eggs']}}]
+        first_id, _ = self.create_plan(json.dumps(plans), goal='Lose weight')
+        self.assertEqual(DietPlan.objects.get(id=first_id).plans[0]['notes'], 'Well done on day one, Ama.')
+        self.assertEqual(len(self.model.prompts), 1)
+
+        other = create_client('other@example.com')
+        other_api = APIClient()
+        other_api.force_authenticate(other.user)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=3)):
+            diet_plan_id, _ = self.create_plan('not used', api=other_api, goal='  lose WEIGHT!')
+        self.assertEqual(len(self.model.prompts), 0)
+        reused = DietPlan.objects.get(id=diet_plan_id)
+        start = date.today() + timedelta(days=3)
+        self.assertEqual([day['date'] for day in reused.plans], [str(start), str(start + timedelta(days=1))])
+        self.assertEqual(reused.plans[1]['meals'], plans[1]['meals'])
+        self.assertEqual([day['notes'] for day in reused.plans], ['', ''])
+        self.assertEqual(gemini_cache_stats()['diet_plan_template'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_different_health_profile_or_fresh_request_misses(self):
+        plans = json.dumps([{'day': 1, 'meals': {'lunch': ['Rice']}}, {'day': 2, 'meals': {'lunch': ['Beans']}}])
+        self.create_plan(plans)
+        self.client_obj.allergies = ['peanuts']
+        self.client_obj.save()
+        self.create_plan(plans)
+        self.assertEqual(len(self.model.prompts), 1)
+        self.create_plan(plans, fresh=True)
+        self.assertEqual(len(self.model.prompts), 1)
+        self.assertEqual(gemini_cache_stats()['diet_plan_template']['misses'], 2)
+
+    @override_settings(DIET_PLAN_PERSONALIZE_NOTES=True)
+    def test_reused_template_notes_can_be_personalized(self):
+        plans = [{'day': 1, 'meals': {'lunch': ['Rice']}, 'notes': 'Drink water.'}, {'day': 2, 'meals': {'lunch': ['Beans']}, 'notes': 'Walk.'}]
+        self.create_plan(json.dumps(plans))
+        model = PromptRouter([('Write a short note', '["Drink water, Ama.", "Walk, Ama."]')])
+        with mock.patch('api.utils.get_gemini', return_value=create_gateway(model, max_retries=0)):
+            diet_plan = DietPlan.objects.create(client=self.client_obj, duration_days=2, status='pending', **{key: self.plan_data[key] for key in ('goal', 'diet_type', 'meal_types', 'activity_level')}, preferred_foods=['rice', 'beans'])
+            with mock.patch('api.diet.use_pusher'):
+                run_diet_plan_job(diet_plan.id)
+        diet_plan.refresh_from_db()
+        self.assertEqual([day['notes'] for day in diet_plan.plans], ['Drink water, Ama.', 'Walk, Ama.'])
+        self.assertEqual(len(model.prompts), 1)
+        self.assertIn('Beans', model.prompts[0])
+        self.assertNotIn('Drink water.', model.prompts[0])
+
+    def test_long_plans_are_generated_in_parallel_chunks(self):
+        # Barrier only releases once all three chunk prompts are in flight
+        model = ChunkedPlanModel(broken={8: 1}, barrier=threading.Barrier(3, timeout=5))
+        diet_plan = DietPlan.objects.create(client=self.client_obj, duration_days=16, status='pending', end_date=date.today() + timedelta(days=15))
+        with mock.patch('api.utils.get_gemini', return_value=create_gateway(model, max_retries=0, max_concurrency=3)), mock.patch('api.diet.use_pusher'):
+            run_diet_plan_job(diet_plan.id)
+        diet_plan.refresh_from_db()
+        self.assertEqual(diet_plan.status, 'ready')
+        self.assertEqual([day['day'] for day in diet_plan.plans], list(range(1, 17)))
+        self.assertEqual(diet_plan.plans[-1]['date'], str(date.today() + timedelta(days=15)))
+        # Only the malformed chunk was asked for twice
+        self.assertEqual(sorted(model.prompts), [1, 8, 8, 15])
+
+    @override_settings(GEMINI_MAX_CONCURRENCY=4)
+    def test_plans_with_more_chunks_than_slots_leave_a_slot_free(self):
+        model = ChunkedPlanModel(delay=0.3)
+        diet_plan = DietPlan.objects.create(client=self.client_obj, duration_days=35, status='pending')
+        gateway = create_gateway(model, max_retries=0, max_concurrency=4, acquire_timeout=0.1)
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.diet.use_pusher'):
+            run_diet_plan_job(diet_plan.id)
+        diet_plan.refresh_from_db()
+        self.assertEqual(diet_plan.status, 'ready')
+        self.assertEqual(sorted(model.prompts), [1, 8, 15, 22, 29])
+        self.assertEqual(model.max_in_flight, 3)
+
+    @override_settings(GEMINI_MAX_CONCURRENCY=4)
+    def test_plans_generated_together_share_the_chunk_slots(self):
+        model = ChunkedPlanModel(delay=0.3)
+        gateway = create_gateway(model, max_retries=0, max_concurrency=4, acquire_timeout=5)
+        plans = [DietPlan(client=self.client_obj, duration_days=21, diet_type='regular') for _ in range(2)]
+        with mock.patch('api.utils.get_gemini', return_value=gateway):
+            threads = [threading.Thread(target=generate_chunked_plans, args=('{}', plan)) for plan in plans]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sorted(model.prompts), [1, 1, 8, 8, 15, 15])
+        self.assertEqual(model.max_in_flight, 3)
+
+    def test_busy_gateway_is_retried_after_a_backoff(self):
+        gateway = mock.Mock(generate=mock.Mock(side_effect=[GeminiUnavailable('busy'), json.dumps([{'day': 1, 'meals': {'lunch': ['Rice']}}])]))
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.diet.time.sleep') as sleep:
+            self.assertEqual(generate_chunk('prompt', 1, 1)[0]['day'], 1)
+        sleep.assert_called_once()
+        self.assertGreaterEqual(sleep.call_args[0][0], settings.GEMINI_BACKOFF)
+
+    def test_plans_orphaned_by_a_restart_are_recovered(self):
+        stale_time = timezone.now() - timedelta(hours=1)
+        orphaned = DietPlan.objects.create(client=self.client_obj, duration_days=2, status='pending')
+        expired = DietPlan.objects.create(client=self.client_obj, duration_days=2, status='pending')
+        running = DietPlan.objects.create(client=self.client_obj, duration_days=2, status='pending')
+        DietPlan.objects.filter(id__in=[orphaned.id, expired.id]).update(updated_at=stale_time)
+
+        self.assertEqual(self.api.get(f"/client/diet_plan/{expired.id}/status").data['status'], 'failed')
+        self.assertEqual(self.api.get(f"/client/diet_plan/{running.id}/status").data['status'], 'pending')
+
+        gateway = create_gateway(ChunkedPlanModel(), max_retries=0)
+        with mock.patch('api.utils.get_gemini', return_value=gateway), mock.patch('api.diet.use_pusher'), \
+                mock.patch('api.management.commands.recover_diet_plans.get_diet_plan_executor', return_value=ImmediateExecutor()):
+            call_command('recover_diet_plans', stdout=StringIO())
+        self.assertEqual(DietPlan.objects.get(id=orphaned.id).status, 'ready')
+        self.assertEqual(DietPlan.objects.get(id=running.id).status, 'pending')
+
+        DietPlan.objects.filter(id=running.id).update(updated_at=stale_time)
+        call_command('recover_diet_plans', fail=True, stdout=StringIO())
+        self.assertEqual(DietPlan.objects.get(id=running.id).status, 'failed')
+
+    def test_chunk_validation(self):
+        day = {'day': 8, 'meals': {'lunch': ['Rice']}, 'notes': ''}
+        self.assertEqual(validate_chunk([day], 8, 1), [day])
+        for chunk in [[day], [dict(day, day=9)], [dict(day, meals={'lunch': 'Rice'})], [dict(day, meals={})], {'day': 8}]:
+            with self.assertRaises(ValueError):
+                validate_chunk(chunk, 8, 2 if chunk == [day] else 1)
+
+    @override_settings(DIET_PLAN_CHUNK_RETRIES=1)
+    def test_chunk_failing_every_retry_fails_the_plan(self):
+        model = ChunkedPlanModel(broken={8: 2})
+        diet_plan = DietPlan.objects.create(client=self.client_obj, duration_days=10, status='pending')
+        with mock.patch('api.utils.get_gemini', return_value=create_gateway(model, max_retries=0)), mock.patch('api.diet.use_pusher'):
+            run_diet_plan_job(diet_plan.id)
+        diet_plan.refresh_from_db()
+        self.assertEqual(diet_plan.status, 'failed')
+        self.assertEqual(sorted(model.prompts), [1, 8, 8])
+
+
+class PlaceOrderTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+
+    def order(self, stocks, quantity=2):
+        items = [{'id': stock.id, 'quantity': stock.quantity, 'order_quantity': quantity} for stock in stocks]
+        return self.api.post('/client/data', {'type': 'placeOrder', 'orderItems': json.dumps(items)})
+
+    def test_query_count_does_not_grow_with_items(self):
+        small = list(create_drug(name='Advil', stocks=1).stocks.all())
+        large = list(create_drug(name='Zoloft', stocks=6).stocks.all())
+        with self.assertNumQueries(11):
+            self.order(small)
+        with self.assertNumQueries(11):
+            response = self.order(large)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 6)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('120.00'))
+        self.assertEqual(set(DrugStock.objects.filter(drug__name='Zoloft').values_list('quantity', flat=True)), {48})
+
+    def test_insufficient_stock_changes_nothing(self):
+        stocks = list(create_drug(name='Advil', stocks=2, quantity=3).stocks.all())
+        version = catalog_version()
+        response = self.order(stocks, quantity=4)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'Only 3 of Advil 0 left in stock')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(set(DrugStock.objects.values_list('quantity', flat=True)), {3})
+        self.assertEqual(catalog_version(), version)
+
+    def test_successful_order_refreshes_catalog(self):
+        stocks = list(create_drug(name='Advil', stocks=1, quantity=3).stocks.all())
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.order(stocks, quantity=3).status_code, 200)
+        self.assertNotEqual(catalog_version(), version)
+        self.assertEqual(get_catalog().count(b'"quantity":0'), 1)
+
+    def test_drug_orders_ship_earliest_expiry_first(self):
+        drug = Drug.objects.create(name='Advil')
+        for batch_number, quantity, days in [('late', 10, 300), ('expired', 10, -1), ('soon', 2, 20), ('sooner', 3, 10), ('empty', 0, 5)]:
+            DrugStock.objects.create(drug=drug, batch_number=batch_number, name=f"Advil {batch_number}", quantity=quantity, price=Decimal('2.00'), expiry_date=date.today() + timedelta(days=days))
+        with self.assertNumQueries(11):
+            response = self.api.post('/client/data', {'type': 'placeOrder', 'orderItems': json.dumps([{'drug_id': drug.id, 'order_quantity': 7}])})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('14.00'))
+        taken = {item.drug.batch_number: item.quantity for item in OrderItem.objects.select_related('drug')}
+        self.assertEqual(taken, {'sooner': 3, 'soon': 2, 'late': 2})
+        self.assertEqual(dict(DrugStock.objects.values_list('batch_number', 'quantity')), {'late': 8, 'expired': 10, 'soon': 0, 'sooner': 0, 'empty': 0})
+
+    def test_drug_order_beyond_sellable_stock_is_rejected(self):
+        drug = create_drug(name='Advil', stocks=2, quantity=3)
+        chosen = drug.stocks.order_by('id').first()
+        items = [{'id': chosen.id, 'quantity': 3, 'order_quantity': 2}, {'drug_id': drug.id, 'order_quantity': 5}]
+        response = self.api.post('/client/data', {'type': 'placeOrder', 'orderItems': json.dumps(items)})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'Only 4 of Advil left in stock')
+        self.assertEqual(set(DrugStock.objects.values_list('quantity', flat=True)), {3})
+
+
+class StockLedgerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj = create_client()
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_obj.user)
+        self.stock = create_drug(name='Advil', stocks=1, quantity=10).stocks.get()
+
+    def place(self, quantity):
+        items = [{'id': self.stock.id, 'quantity': 10, 'order_quantity': quantity}]
+        return self.api.post('/client/data', {'type': 'placeOrder', 'orderItems': json.dumps(items)}).data['id']
+
+    def ledger(self):
+        return list(StockMovement.objects.filter(stock=self.stock).order_by('id').values_list('kind', 'quantity'))
+
+    def test_sales_cancellations_and_edits_are_recorded(self):
+        order_id = self.place(4)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 6)
+
+        response = self.api.post('/client/data', {'type': 'deleteOrder', 'itemId': order_id})
+        self.assertEqual(response.status_code, 204)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 10)
+        self.assertEqual(Order.objects.get(id=order_id).status, 'cancelled')
+        self.assertEqual(list(StockMovement.objects.filter(order_id=order_id).order_by('id').values_list('kind', flat=True)), ['sale', 'cancellation'])
+        response = self.api.post('/client/data', {'type': 'deleteOrder', 'itemId': order_id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'This order can no longer be cancelled')
+        self.assertEqual(StockMovement.objects.filter(order_id=order_id).count(), 2)
+
+        self.stock.quantity = 7
+        self.stock.save()
+        self.assertEqual(self.ledger(), [('receipt', 10), ('sale', -4), ('cancellation', 4), ('adjustment', -3)])
+        self.assertEqual(stock_drift(), {})
+
+    def test_clients_cannot_cancel_other_orders(self):
+        order_id = self.place(4)
+        other = APIClient()
+        other.force_authenticate(create_client('other@example.com').user)
+        self.assertEqual(other.post('/client/data', {'type': 'deleteOrder', 'itemId': order_id}).status_code, 404)
+        self.assertTrue(Order.objects.filter(id=order_id).exists())
+
+    def test_reconcile_rebuilds_quantities_from_ledger(self):
+        self.place(4)
+        DrugStock.objects.filter(id=self.stock.id).update(quantity=50)
+        self.assertEqual(stock_drift(), {self.stock.id: (50, 6)})
+        out = StringIO()
+        call_command('reconcile_stock', '--fix', stdout=out)
+        self.assertIn(f"Stock {self.stock.id}: on hand 50, ledger 6", out.getvalue())
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 6)
+        self.assertEqual(rebuild_quantities(), {})
+
+    def test_negative_ledger_is_reported_not_clamped(self):
+        StockMovement.objects.create(stock=self.stock, kind='adjustment', quantity=-15, note='Miskeyed count')
+        self.assertEqual(stock_drift(), {self.stock.id: (10, -5)})
+        out = StringIO()
+        call_command('reconcile_stock', '--fix', stdout=out)
+        self.assertIn(f"Stock {self.stock.id}: on hand 10, ledger -5", out.getvalue())
+        self.assertIn(f"Stock {self.stock.id} have a negative ledger and were not rebuilt", out.getvalue())
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 10)
+        self.assertEqual(stock_drift(), {self.stock.id: (10, -5)})
+
+
+class ClientQueryBenchmarkTest(TestCase):
+    def test_reports_plans_before_and_after_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_client_queries', clients=3, rows=4, batches=20, rounds=1, stdout=out)
+        for name in ['consultations', 'orders', 'order_items', 'messages', 'diet_plans', 'drug_batches']:
+            self.assertIn(f"{name}: ", out.getvalue())
+        self.assertIn('drugstock_drug_expiry_idx', out.getvalue())
+        self.assertFalse(Client.objects.exists())
+        self.assertFalse(DrugStock.objects.exists())
+
+    def test_collections_are_measured_a_page_at_a_time(self):
+        client = create_client()
+        for index in range(3):
+            Message.objects.create(client=client, sender='user', message=f"Message {index}")
+        queries = client_queries(client, create_drug(name='Advil'))
+        for name in ['consultations', 'orders', 'messages']:
+            self.assertIn(f"LIMIT {settings.CLIENT_PAGE_SIZE + 1}", str(queries[name].query))
+        self.assertEqual([row['id'] for row in queries['messages']], list(Message.objects.order_by('-id').values_list('id', flat=True)))
+
+
+class ValuesSerializerTest(TestCase):
+    def setUp(self):
+        self.client_obj = create_client()
+        staff = create_staff()
+        seed_client_activity(self.client_obj, staff, 3)
+        seed_client_activity(self.client_obj, create_staff('plain@example.com'), 1)
+        Staff.objects.filter(user__username='plain@example.com').update(img=None)
+        Consultation.objects.create(client=self.client_obj, staff=staff, type='new')
+        Order.objects.create(client=self.client_obj, address='Empty', total_price=Decimal('3.5'))
+        Drug.objects.create(name='Pictured', img='images/drug_images/pictured.png')
+
+    def assert_same_output(self, queryset, serializer, values_serializer):
+        expected = JSONRenderer().render(serializer(queryset, many=True).data)
+        self.assertEqual(JSONRenderer().render(values_serializer().serialize(queryset)), expected)
+
+    def test_output_is_byte_identical(self):
+        self.assert_same_output(catalog_drugs(), DrugSerializerOne, DrugValuesSerializer)
+        self.assert_same_output(client_consultations(self.client_obj), ConsultationSerializerOne, ConsultationValuesSerializer)
+        self.assert_same_output(client_orders(self.client_obj), OrderSerializerOne, OrderValuesSerializer)
+        self.assert_same_output(client_messages(self.client_obj), MessageSerializerOne, MessageValuesSerializer)
+        self.assert_same_output(client_diet_plans(self.client_obj), DietPlanSerializerOne, DietPlanValuesSerializer)
+
+    def test_related_rows_are_read_once_per_page(self):
+        with self.assertNumQueries(2):
+            OrderValuesSerializer().serialize(client_orders(self.client_obj))
+        with self.assertNumQueries(1):
+            OrderValuesSerializer(['id', 'total_price']).serialize(client_orders(self.client_obj))
+
+    def test_benchmark_checks_output_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_serializers', rows=20, rounds=1, stdout=out)
+        for name in ['drugs', 'consultations', 'orders', 'messages']:
+            self.assertIn(f"{name}: ", out.getvalue())
+        self.assertEqual(Drug.objects.count(), 5)
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    def test_parallel_checkouts_never_oversell(self):
+        stock = create_drug(name='Advil', stocks=1, quantity=10).stocks.get()
+        clients = [create_client(f"buyer{index}@example.com") for index in range(8)]
+        barrier = threading.Barrier(len(clients), timeout=10)
+        statuses = []
+
+        def checkout(client):
+            api = APIClient(raise_request_exception=False)
+            api.force_authenticate(client.user)
+            barrier.wait()
+            try:
+                response = api.post('/client/data', {'type': 'placeOrder', 'orderItems': json.dumps([{'id': stock.id, 'quantity': 10, 'order_quantity': 3}])})
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stock.refresh_from_db()
+        sold = sum(OrderItem.objects.filter(drug=stock).values_list('quantity', flat=True))
+        self.assertEqual(len(statuses), len(clients))
+        self.assertGreaterEqual(statuses.count(200), 1)
+        self.assertLessEqual(statuses.count(200), 3)
+        self.assertEqual(Order.objects.count(), statuses.count(200))
+        self.assertEqual(sold, 3 * statuses.count(200))
+        self.assertEqual(stock.quantity, 10 - sold)
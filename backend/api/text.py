@@ -0,0 +1,53 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+STOP_WORDS = {
+    'a', 'about', 'after', 'all', 'am', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'can',
+    'could', 'do', 'does', 'for', 'from', 'get', 'had', 'has', 'have', 'he', 'her', 'him', 'his', 'how', 'i', 'if',
+    'in', 'into', 'is', 'it', 'its', 'just', 'me', 'my', 'need', 'of', 'on', 'or', 'our', 'please', 'she', 'so',
+    'some', 'than', 'that', 'the', 'their', 'them', 'then', 'there', 'these', 'they', 'this', 'to', 'too', 'up',
+    'us', 'very', 'want', 'was', 'we', 'were', 'what', 'when', 'which', 'who', 'why', 'will', 'with', 'would',
+    'you', 'your',
+}
+
+
+def stem(word):
+    for suffix, replacement in (('ies', 'y'), ('ing', ''), ('ed', ''), ('es', ''), ('s', '')):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", str(text or '').lower()) if word not in STOP_WORDS]
+
+
+# Small in-memory TF-IDF index over already tokenized documents, scored by
+# cosine similarity through an inverted index
+class TfidfIndex:
+    def __init__(self, documents):
+        document_frequency = Counter()
+        for tokens in documents.values():
+            document_frequency.update(set(tokens))
+        total = len(documents)
+        self.idf = {term: math.log((1 + total) / (1 + count)) + 1 for term, count in document_frequency.items()}
+        self.postings = defaultdict(list)
+        for key, tokens in documents.items():
+            vector = self.vectorize(tokens)
+            for term, weight in vector.items():
+                self.postings[term].append((key, weight))
+
+    def vectorize(self, tokens):
+        counts = Counter(token for token in tokens if token in self.idf)
+        vector = {term: count * self.idf[term] for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def query(self, tokens, limit=None):
+        scores = defaultdict(float)
+        for term, weight in self.vectorize(tokens).items():
+            for key, document_weight in self.postings[term]:
+                scores[key] += weight * document_weight
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
@@ -21,6 +21,16 @@ urlpatterns = [
     # client 
     path('client/registration', register_client),
     path('client/data', client_data),
+    path('client/drug/<int:drug_id>', drug_detail),
+    path('client/drug/catalog', drug_catalog),
+    path('client/drug/search', drug_search),
+    path('client/drug/autocomplete', drug_autocomplete),
+    path('client/chat/stream', chat_stream),
+    path('client/diet_plan/<int:diet_plan_id>/status', diet_plan_status),
+    path('client/collection/<str:collection>', client_collection),
+
+    # monitoring
+    path('llm/cache_stats', llm_cache_stats),
 
     # query
     # path('query', query),
@@ -1,9 +1,9 @@
 import os
 from datetime import datetime, timedelta
-import google.generativeai as genai
 
 # django
 from django.core.validators import EmailValidator
+from django.db import transaction
 from django.conf import settings
 from django.http import FileResponse
 
@@ -18,6 +18,10 @@ import secrets
 import string
 import requests
 import io
+import time
+from concurrent.futures import Future
+from api.gemini import get_gemini, submit_gemini_task, cached_generate, lookup_cached_response, generate_and_cache
+from api.counters import get_counter, increment_counter
 
 
 # Base url
@@ -68,6 +72,31 @@ def use_pusher():
     return pusher_client
 
 
+# Version counters kept in the database; cached derived data is keyed by the
+# version so bumping it invalidates every worker's copy. Bumps are atomic, so
+# two at the same time always count as two, and are made in the transaction
+# of the change so the new version never commits before the data it stands
+# for. Each worker rereads a version at most every CACHE_VERSION_REFRESH
+# seconds, and at once after its own bumps.
+_versions = {}
+
+
+def get_cache_version(key):
+    read_at, version = _versions.get(key, (0, None))
+    if version is None or time.monotonic() - read_at > settings.CACHE_VERSION_REFRESH:
+        # Seeded from the clock so a new counter never points back at entries
+        # still in the cache from an earlier one
+        version = get_counter(key, initial=time.time_ns())
+        _versions[key] = (time.monotonic(), version)
+    return version
+
+
+def bump_cache_version(key):
+    increment_counter(key, initial=time.time_ns())
+    _versions.pop(key, None)
+    transaction.on_commit(lambda: _versions.pop(key, None))
+
+
 class ErrorMessageException(Exception):
     def __init__(self, message):
         self.message = message
@@ -179,10 +208,25 @@ def send_file(file_type:str, byte_file:io.BytesIO, filename:str):
     return response
 
 
-def send_prompt_to_gemini(message):
-    api_key = os.environ.get('GEMINI_KEY')
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("models/gemini-1.5-flash")
-    response = model.generate_content(message)
+def send_prompt_to_gemini(message, cache_site=None):
+    if cache_site:
+        return cached_generate(message, cache_site)
+    return get_gemini().generate(message)
+
+
+def stream_prompt_to_gemini(message):
+    return get_gemini().stream(message)
+
 
-    return response.text
\ No newline at end of file
+# Runs the prompt on the shared Gemini thread pool so independent prompts can
+# be in flight at the same time; returns a Future. The response cache is
+# looked up (and its counters updated) here, so the pool only calls Gemini.
+def submit_prompt_to_gemini(message, cache_site=None):
+    if not cache_site:
+        return submit_gemini_task(send_prompt_to_gemini, message)
+    key, response = lookup_cached_response(message, cache_site)
+    if response is None:
+        return submit_gemini_task(generate_and_cache, key, message, cache_site)
+    future = Future()
+    future.set_result(response)
+    return future
\ No newline at end of file
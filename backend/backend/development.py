@@ -24,7 +24,7 @@ DATABASES = {
 
 # INSTALLED_APPS += ['silk']
 
-# GZIP_MIDDLEWARE = 'django.middleware.gzip.GZipMiddleware'
+# GZIP_MIDDLEWARE = 'api.middleware.StreamingGZipMiddleware'
 # if GZIP_MIDDLEWARE in MIDDLEWARE:
 #     sec_index = MIDDLEWARE.index(GZIP_MIDDLEWARE)
 #     MIDDLEWARE.insert(sec_index + 1, 'silk.middleware.SilkyMiddleware')
@@ -16,6 +16,19 @@ DATABASES = {
     )
 }
 
+# The default cache is shared by every worker, so a catalog snapshot
+# rendered by one worker is reused by the others; its table is created on
+# migrate. The llm cache stays in each worker (settings.CACHES) for its LRU
+# eviction; its hit/miss counters are kept in the database.
+CACHES = {
+    **CACHES,
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
 # Cors Config
 CORS_ALLOWED_ORIGINS = [
     "https://aivisehealth.onrender.com",
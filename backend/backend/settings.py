@@ -40,7 +40,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.gzip.GZipMiddleware',
+    'api.middleware.StreamingGZipMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -105,7 +105,13 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # Picked by the Accept header; JSON when the client does not say
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'api.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -148,6 +154,86 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 
+# Gemini
+GEMINI_MODEL = "models/gemini-1.5-flash"
+GEMINI_TIMEOUT = 30
+GEMINI_MAX_RETRIES = 2
+GEMINI_BACKOFF = 0.5
+GEMINI_MAX_BACKOFF = 4
+GEMINI_MAX_CONCURRENCY = 4
+GEMINI_ACQUIRE_TIMEOUT = 10
+# Response cache TTL (seconds) per call site
+GEMINI_CACHE_TIMEOUTS = {
+    'consultation_name': 60 * 60 * 24 * 7,
+    'message_intent': 60 * 60 * 24,
+    'diet_plan_template': 60 * 60 * 24 * 30,
+}
+
+# Minimum local match score before staff matching falls back to Gemini
+STAFF_MATCH_THRESHOLD = 0.2
+
+# Local chat intent classifier: minimum posterior before falling back to
+# Gemini, and how often (seconds) it is retrained on labelled messages
+INTENT_CONFIDENCE_THRESHOLD = 0.7
+INTENT_MODEL_REFRESH = 60 * 60
+
+# Chat history sent to Gemini: recent turns up to a token budget, older
+# turns folded into a rolling summary per client
+CHAT_HISTORY_TOKEN_BUDGET = 1500
+CHAT_HISTORY_MAX_MESSAGES = 60
+CHAT_SUMMARY_MAX_WORDS = 200
+CHAT_SUMMARY_BATCH = 100
+# Evicted turns waiting before the summary is updated
+CHAT_SUMMARY_MIN_BATCH = 20
+# In-stock items sent with each chat message
+CHAT_MEDICINE_CONTEXT_SIZE = 8
+
+# Rows per page of a client's consultations, orders and messages
+CLIENT_PAGE_SIZE = 20
+
+# Delta syncs (client/data?since=...) look this many seconds further back than
+# their token, and tokens older than the tombstone retention get a full reload
+CLIENT_SYNC_OVERLAP = 5
+CLIENT_SYNC_TOMBSTONE_DAYS = 30
+
+# Background threads per worker generating diet plans, and how long (seconds)
+# a plan can stay pending before it is taken to have lost its job
+DIET_PLAN_WORKERS = 2
+DIET_PLAN_STALE_AFTER = 15 * 60
+
+# Diet plans are generated this many days per Gemini prompt, with malformed
+# chunks asked for again up to DIET_PLAN_CHUNK_RETRIES times
+DIET_PLAN_CHUNK_DAYS = 7
+DIET_PLAN_CHUNK_RETRIES = 2
+
+# Ask Gemini to write notes for the client when a diet plan is reused from a
+# template. Templates are stored without notes, so reused plans otherwise
+# have none
+DIET_PLAN_PERSONALIZE_NOTES = False
+
+# Compression levels of payloads stored compressed once per version (the
+# drug catalog). Brotli 10 and 11 take seconds on the catalog, which gets a
+# new version with every order, for no gain over 9.
+PRECOMPRESS_GZIP_LEVEL = 9
+PRECOMPRESS_BROTLI_QUALITY = 9
+
+# How often (seconds) each worker rereads the versions behind its cached
+# catalog and staff roster (see api.utils.get_cache_version)
+CACHE_VERSION_REFRESH = 5
+
+# Cache. Per process here; production shares the default one between
+# workers. The llm one is an LRU cache in each worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'llm': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'llm',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
 # Cloudinary config
 CLOUDINARY_STORAGE = {
     'CLOUD_NAME': os.environ.get('CLOUDINARY_NAME'),
@@ -6,6 +6,10 @@ import { AxiosError } from 'axios'
 import router from '@/router'
 import type { StaffUserData, ClientUserData, ConsultationOne, Order, Drug, Message, DietPlan } from '@/utils/types_utils'
 
+// Collections client/data sends one page of; older pages come from
+// client/collection/<name> with the cursor it returned
+export type ClientCollection = 'consultations' | 'orders' | 'messages'
+
 export interface states {
   userData: (StaffUserData & { address?: string | null; allergies?: string[]; health_conditions?: string[] }) | ClientUserData | null
   accessToken: string;
@@ -20,6 +24,7 @@ export interface states {
   clientOrders: Order[];
   messages: Message[];
   dietPlans: DietPlan[];
+  cursors: Record<ClientCollection, string | null>;
 }
 
 
@@ -39,6 +44,7 @@ export const useUserAuthStore = defineStore('userAuthStore', {
       clientOrders: [],
       messages: [],
       dietPlans: [],
+      cursors: {consultations: null, orders: null, messages: null},
     }
   },
 
@@ -82,6 +88,7 @@ export const useUserAuthStore = defineStore('userAuthStore', {
         this.clientOrders = response.data['orders']
         this.messages = response.data['messages']
         this.dietPlans = response.data['diet_plans']
+        this.cursors = {...this.cursors, ...response.data['cursors']}
         this.fetchedDataLoaded = true
       }
       catch (e) {
@@ -89,6 +96,29 @@ export const useUserAuthStore = defineStore('userAuthStore', {
       }
     },
 
+    async loadOlderClientData(collection: ClientCollection) {
+      const cursor = this.cursors[collection]
+      if (!cursor) return;
+      try {
+        const response = await axiosInstance.get(`client/collection/${collection}`, {params: {cursor: cursor}})
+        const results = response.data['results']
+        if (collection === 'consultations') {
+          this.clientConsultations.push(...results)
+        }
+        else if (collection === 'orders') {
+          this.clientOrders.push(...results)
+        }
+        else {
+          // Messages are kept oldest first
+          this.messages.unshift(...results)
+        }
+        this.cursors[collection] = response.data['next_cursor']
+      }
+      catch (e) {
+        return Promise.reject(e)
+      }
+    },
+
     async getUserData(user_role: string) {
       try {
         const response = await axiosInstance.get('user/data', {params: {role: user_role}})
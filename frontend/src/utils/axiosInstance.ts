@@ -15,33 +15,45 @@ export const axiosInstance = axios.create({
 });
 
 
+// Authorization header of the logged in user, refreshing the access token
+// first when it is about to expire. Also used by requests made with fetch
+// (streamed responses), which skip the interceptor below.
+export const getAuthorizationHeader = async () => {
+  const userAuthStore = useUserAuthStore();
+  const accessToken = userAuthStore.accessToken;
+  if (!accessToken) {
+    return null;
+  }
+
+  const bufferTime = 120
+  const serverDateTime = await userAuthStore.getCurrentServerTime()
+  userAuthStore.currentDate = serverDateTime['current_date']
+  const currentTimestamp = serverDateTime['timestamp']
+
+  const tokenExpTimestamp = jwtDecode(accessToken).exp || 0
+  if ((currentTimestamp + bufferTime) >= tokenExpTimestamp) {
+    await userAuthStore.UpdateToken()
+    return `Bearer ${userAuthStore.accessToken}`;
+  }
+  return `Bearer ${accessToken}`;
+}
+
+// Absolute url of an api path, for requests made without axios
+export const apiUrl = (path: string) => `${(baseURL || '').replace(/\/+$/, '')}/${path}`
+
+
 // request interceptor
 axiosInstance.interceptors.request.use(
   async (config) => {
-    const userAuthStore = useUserAuthStore();
-    const accessToken = userAuthStore.accessToken;
-
-    if (accessToken) {
-      const bufferTime = 120
-      const serverDateTime = await userAuthStore.getCurrentServerTime()
-      userAuthStore.currentDate = serverDateTime['current_date']
-      const currentTimestamp = serverDateTime['timestamp']
-      
-      let tokenExpTimestamp = jwtDecode(accessToken).exp || 0
-      tokenExpTimestamp = tokenExpTimestamp;
-      if ((currentTimestamp + bufferTime) >= tokenExpTimestamp) {
-        try {
-          await userAuthStore.UpdateToken()
-          config.headers.Authorization = `Bearer ${userAuthStore.accessToken}`;
-        }
-        catch (e) {
-          return Promise.reject(e);
-        }
-      } 
-      else {
-        config.headers.Authorization = `Bearer ${accessToken}`;
+    try {
+      const authorization = await getAuthorizationHeader()
+      if (authorization) {
+        config.headers.Authorization = authorization;
       }
     }
+    catch (e) {
+      return Promise.reject(e);
+    }
 
     return config;
   },
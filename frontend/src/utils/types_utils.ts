@@ -84,16 +84,17 @@ export interface Drug {
   name: string;
   generic_name: string
   brand: string
-  description: string;
+  // Only sent by client/drug/<id>, not with the catalog
+  description?: string;
   dosage_form: string[];
   route: string[];
-  pharm_class: string[];
-  indications: string;
-  side_effects: string;
-  precautions: string;
+  pharm_class?: string[];
+  indications?: string;
+  side_effects?: string;
+  precautions?: string;
   active_ingredients: string[];
-  warnings: string;
-  storage: string;
+  warnings?: string;
+  storage?: string;
   manufacturer: string
   stocks: DrugStock[];
   is_prescription_required: boolean;
@@ -138,4 +139,5 @@ export interface DietPlan {
   preferred_foods: string[];
   end_date: string;
   plans: DietPlanItem[]
+  status: "pending" | "ready" | "failed";
 }
\ No newline at end of file